@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""Benchmark sorting versions: cached tuple keys of multi_sort() against the previous padded ord() lists.
+
+CPU time is reported so other processes don't skew results. Run from the repository root:
+
+    python benchmarks/semver_sort.py
+"""
+
+import random
+import time
+
+import click
+
+from sphinxcontrib.versioning.versions import multi_sort, RE_SEMVER, semver_key
+
+
+def old_semvers(names):
+    """Parse versions into integers and convert non-integer meta indicators into integers with ord().
+
+    :param iter names: List of strings representing versions/tags/branches.
+
+    :return: List of parsed versions. E.g. v1.10.0b3 -> [0, 1, 10, 0, ord('b'), ord('3')]
+    :rtype: list
+    """
+    matches = [(RE_SEMVER.findall(n) or [[]])[0] for n in names]
+    max_len_ints = 0
+    max_len_str = 0
+
+    # Get max lens for padding.
+    for match in (m for m in matches if m):
+        max_len_ints = len(match)  # Never changes.
+        max_len_str = max(max_len_str, len(match[-1]))
+    if not max_len_ints:
+        return matches  # Nothing to do, all empty.
+    invalid_template = [1] + [0] * (max_len_ints + max_len_str - 1)
+
+    # Parse.
+    exploded_semver = list()
+    for match in matches:
+        if not match:
+            exploded_semver.append(invalid_template[:])
+            continue
+        version_ints = [-int(i or 0) for i in match[:-1]]
+        ints_of_str = [ord(i) for i in match[-1]] + [0] * (max_len_str - len(match[-1]))
+        exploded_semver.append([0] + version_ints + ints_of_str)
+
+    return exploded_semver
+
+
+def old_multi_sort(remotes, sort):
+    """Sort `remotes` in place, like multi_sort() did before semver_key().
+
+    :param iter remotes: List of dicts from Versions().remotes.
+    :param iter sort: What to sort by. May be one or more of: alpha, time, semver
+    """
+    exploded_alpha = list()
+    exploded_semver = list()
+
+    # Convert name to int if alpha is in sort.
+    if 'alpha' in sort:
+        alpha_max_len = max(len(r['name']) for r in remotes)
+        for name in (r['name'] for r in remotes):
+            exploded_alpha.append([ord(i) for i in name] + [0] * (alpha_max_len - len(name)))
+
+    # Parse versions if semver is in sort.
+    if 'semver' in sort:
+        exploded_semver = old_semvers(r['name'] for r in remotes)
+
+    # Build sort_mapping dict.
+    sort_mapping = dict()
+    for i, remote in enumerate(remotes):
+        key = list()
+        for sort_by in sort:
+            if sort_by == 'alpha':
+                key.extend(exploded_alpha[i])
+            elif sort_by == 'time':
+                key.append(-remote['date'])
+            elif sort_by == 'semver':
+                key.extend(exploded_semver[i])
+        sort_mapping[id(remote)] = key
+
+    # Sort.
+    remotes.sort(key=lambda k: sort_mapping.get(id(k)))
+
+
+def make_remotes(tags, seed):
+    """Create fake version dicts, mostly semver tags with some pre-releases and a few branches, in random order.
+
+    :param int tags: Number of version dicts.
+    :param int seed: Random seed, same versions every run.
+
+    :return: List of dicts with name and date keys.
+    :rtype: list
+    """
+    rand = random.Random(seed)
+    suffixes = ('', '', '', '', 'rc1', 'b2', 'a1', '.post1', '.dev3', '-beta')
+    remotes = list()
+    for i in range(tags):
+        if i % 50:
+            name = 'v{0}.{1}.{2}{3}'.format(i // 2000, i // 50 % 40, i % 50, rand.choice(suffixes))
+        else:
+            name = 'feature_{0}'.format(i)
+        remotes.append(dict(name=name, date=rand.randrange(1200000000, 1700000000)))
+    rand.shuffle(remotes)
+    return remotes
+
+
+def timed(function, remotes, sort, rounds):
+    """Best CPU time of sorting a fresh copy of remotes a few times.
+
+    :param function function: multi_sort() or old_multi_sort().
+    :param list remotes: Version dicts to sort.
+    :param tuple sort: Passed to function.
+    :param int rounds: Number of rounds.
+
+    :return: CPU milliseconds of the fastest round.
+    :rtype: float
+    """
+    best = None
+    for _ in range(rounds):
+        copy = remotes[:]
+        start = time.process_time()
+        function(copy, sort)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+@click.command()
+@click.option('--tags', default=40000, help='Number of branches/tags. Default 40000.')
+@click.option('--rounds', default=3, help='Best of this many rounds. Default 3.')
+@click.option('--seed', default=0, help='Random seed.')
+def main(tags, rounds, seed):
+    """Time multi_sort() with different sort settings.
+
+    :param int tags: Number of branches/tags.
+    :param int rounds: Best of this many rounds.
+    :param int seed: Random seed.
+    """
+    remotes = make_remotes(tags, seed)
+    click.echo('{0} versions, best of {1}, CPU ms:'.format(tags, rounds))
+    click.echo('{0:20} {1:>10} {2:>10}'.format('sort', 'before', 'after'))
+
+    def cold(copy, sort):
+        """Sort with an empty semver_key() cache."""
+        semver_key.cache_clear()
+        multi_sort(copy, sort)
+
+    rows = (
+        ('semver (cold)', ('semver',), cold),
+        ('semver (cached)', ('semver',), multi_sort),
+        ('semver, time', ('semver', 'time'), multi_sort),
+        ('alpha', ('alpha',), multi_sort),
+        ('time', ('time',), multi_sort),
+    )
+    for label, sort, function in rows:
+        before = timed(old_multi_sort, remotes, sort, rounds)
+        after = timed(function, remotes, sort, rounds)
+        click.echo('{0:20} {1:10.1f} {2:10.1f}'.format(label, before, after))
+
+    # Both must agree where PEP 440 suffixes don't change the order.
+    plain = [r for r in remotes if RE_SEMVER.match(r['name']) and r['name'][-1].isdigit() and '.' in r['name'][1:]]
+    plain = [r for r in plain if not any(s in r['name'] for s in ('rc', 'b', 'a', 'post', 'dev'))]
+    old, new = plain[:], plain[:]
+    old_multi_sort(old, ('semver', 'time'))
+    multi_sort(new, ('semver', 'time'))
+    if [r['name'] for r in old] != [r['name'] for r in new]:
+        raise click.ClickException('Sort orders differ.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""Benchmark Versions lookups while rendering sidebars: indexed Remotes against the previous linear scans.
+
+Every page of every version calls vpathto() and vhasdoc() for every version, this times that for all pages of one
+version. CPU time is reported so other processes don't skew results. Run from the repository root:
+
+    python benchmarks/versions_lookup.py
+"""
+
+import random
+import time
+
+import click
+
+from sphinxcontrib.versioning.versions import Versions
+
+
+class LinearVersions(Versions):
+    """Versions with the __getitem__() scans used before Remotes indexes."""
+
+    def __getitem__(self, item):
+        """Retrieve a version dict from self.remotes by any of its attributes."""
+        # First assume item is an attribute.
+        for key in ('id', 'sha', 'name', 'date'):
+            for remote in self.remotes:
+                if remote[key] == item:
+                    return remote
+        # Next assume item is a substring of a sha.
+        try:
+            length = len(item)
+        except TypeError:  # Not an int.
+            length = 0
+        if length >= 5:
+            for remote in self.remotes:
+                if item in remote['sha']:
+                    return remote
+        # Finally assume it's an index. Raises IndexError if item is int.
+        try:
+            return self.remotes[item]
+        except TypeError:
+            pass
+        # Nothing found, IndexError not raised. item was probably a string, raising KeyError.
+        raise KeyError(item)
+
+
+def make_versions(cls, refs, pages, seed):
+    """Create a Versions instance with fake branches/tags, each having most of the pages.
+
+    :param type cls: Versions or a subclass.
+    :param int refs: Number of branches/tags.
+    :param int pages: Number of documents.
+    :param int seed: Random seed, same versions every run.
+
+    :return: Versions instance and list of document names.
+    :rtype: tuple
+    """
+    rand = random.Random(seed)
+    remotes = list()
+    for i in range(refs):
+        sha = '{0:040x}'.format(rand.getrandbits(160))
+        if i % 5:
+            name, kind = 'v{0}.{1}.{2}'.format(i // 400, i // 20 % 20, i % 20), 'tags'
+        else:
+            name, kind = 'branch_{0}'.format(i), 'heads'
+        remotes.append((sha, name, kind, 1500000000 + i * 3600, 'docs/conf.py'))
+    versions = cls(remotes, sort=('semver', 'alpha'))
+
+    docnames = ['section{0}/page{1}'.format(i // 100, i) for i in range(pages)]
+    for remote in versions.remotes:
+        versions.set_found_docs(remote, [d for d in docnames if rand.random() < 0.9])
+        remote['master_doc'] = 'index'
+    return versions, docnames
+
+
+def render_sidebars(versions, docnames):
+    """Call vpathto() and vhasdoc() for every version on every page, like versions.html without caching.
+
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param iter docnames: Pages to render.
+
+    :return: CPU seconds taken.
+    :rtype: float
+    """
+    names = [r['name'] for r in versions.remotes]
+    current = names[0]
+    start = time.process_time()
+    for pagename in docnames:
+        versions.context = dict(current_version=current, pagename=pagename, scv_is_root=False)
+        for name in names:
+            versions.vpathto(name)
+            versions.vhasdoc(name)
+    return time.process_time() - start
+
+
+@click.command()
+@click.option('--refs', default=1000, help='Number of branches/tags. Default 1000.')
+@click.option('--pages', default=200, help='Number of pages rendered. Default 200.')
+@click.option('--only', type=click.Choice(('indexed', 'linear')), help='Only time one implementation.')
+@click.option('--seed', default=0, help='Random seed.')
+def main(refs, pages, only, seed):
+    """Time sidebar lookups for all pages of one version.
+
+    :param int refs: Number of branches/tags.
+    :param int pages: Number of pages rendered.
+    :param str only: Only time this implementation.
+    :param int seed: Random seed.
+    """
+    for label, cls in (('indexed', Versions), ('linear', LinearVersions)):
+        if only and only != label:
+            continue
+        versions, docnames = make_versions(cls, refs, pages, seed)
+        seconds = render_sidebars(versions, docnames)
+        click.echo('{0:8} {1} refs x {2} pages: {3:10.1f} CPU s total, {4:9.2f} ms/page'.format(
+            label, refs, pages, seconds, seconds * 1000 / pages))
+
+
+if __name__ == '__main__':
+    main()
@@ -93,9 +93,11 @@ if __name__ == '__main__':
         name=NAME,
         package_data={'': [
             os.path.join('_static', 'banner.css'),
+            os.path.join('_static_json', 'versions.js'),
             os.path.join('_templates', 'banner.html'),
             os.path.join('_templates', 'layout.html'),
             os.path.join('_templates', 'versions.html'),
+            os.path.join('_templates', 'versions_list.html'),
         ]},
         packages=['sphinxcontrib', os.path.join('sphinxcontrib', 'versioning')],
         url='https://github.com/Smile-SA/' + NAME,
@@ -8,8 +8,9 @@ import time
 import click
 
 from sphinxcontrib.versioning import __version__
-from sphinxcontrib.versioning.git import clone, get_root, GitError
+from sphinxcontrib.versioning.git import clone, get_root, GitError, STATS
 from sphinxcontrib.versioning.lib import Config, HandledError, TempDir
+from sphinxcontrib.versioning.publish import prune, publish
 from sphinxcontrib.versioning.routines import build_all, gather_git_info, pre_build, read_local_conf
 from sphinxcontrib.versioning.setup_logging import setup_logging
 from sphinxcontrib.versioning.versions import multi_sort, Versions
@@ -121,7 +122,7 @@ class ClickCommand(click.Command):
 def cli(config, **options):
     """Build versioned Sphinx docs for every branch and tag pushed to origin.
 
-    Supports only building locally with the "build" sub command
+    Supports building locally with the "build" sub command and rebuilding changed versions with "watch".
     For more information, run with its own --help.
 
     The options below are global and must be specified before the sub command name (e.g. -N build ...).
@@ -188,13 +189,62 @@ def build_options(func):
     func = click.option('-b', '--show-banner', help='Show a warning banner.', is_flag=True)(func)
     func = click.option('-B', '--banner-main-ref',
                         help="Don't show banner on this ref and point banner URLs to this ref. Default master.")(func)
+    func = click.option('--blacklist-branches', multiple=True,
+                        help='Exclude branches that match the pattern. Can be specified more than once.')(func)
+    func = click.option('--blacklist-tags', multiple=True,
+                        help='Exclude tags that match the pattern. Can be specified more than once.')(func)
+    func = click.option('--blob-store', is_flag=True,
+                        help='Export files as hardlinks into a store of unique git blobs (in --cache-dir if '
+                             'set).')(func)
+    func = click.option('--cache-dir', type=click.Path(file_okay=False, dir_okay=True),
+                        help='Persistent cache directory. Reuse builds of versions that did not change.')(func)
+    func = click.option('--changes-file', type=click.Path(file_okay=True, dir_okay=False),
+                        help='Write files added, updated and deleted by --sync/--generations to this JSON file.')(func)
+    func = click.option('--cache-size', type=click.IntRange(0, None),
+                        help='Evict least recently used cached builds above this many megabytes, 0 disables. Default '
+                             '1024.')(func)
+    func = click.option('--explain-cache', is_flag=True,
+                        help='Log why each version was rebuilt instead of copied from the cache.')(func)
+    func = click.option('--export-path', 'export_paths', multiple=True,
+                        help='Also export this path (relative to the git root) with --limit-export. Can be specified '
+                             'more than once.')(func)
+    func = click.option('--generations', type=click.IntRange(2, None),
+                        help='Publish atomically: build a new directory in DESTINATION, point DESTINATION/current to '
+                             'it and keep this many of them (at least 2).')(func)
+    func = click.option('--incremental', is_flag=True,
+                        help='Keep Sphinx environments per ref in --cache-dir to only re-read changed pages.')(func)
+    func = click.option('--keep-branches', type=click.IntRange(1, None),
+                        help='Only build this many most recently committed branches.')(func)
+    func = click.option('--keep-patches', type=click.IntRange(1, None),
+                        help='Only build this many latest patch releases (tags) of each major.minor version.')(func)
+    func = click.option('--keep-tags-since', metavar='YYYY-MM-DD',
+                        help='Only build tags committed since this date.')(func)
+    func = click.option('--limit-export', is_flag=True,
+                        help='Only export the REL_SOURCE directory (and --export-path) of each version.')(func)
     func = click.option('-i', '--invert', help='Invert/reverse order of versions.', is_flag=True)(func)
+    func = click.option('-j', '--jobs', type=click.IntRange(1, None),
+                        help='Run up to this many sphinx-build processes at the same time. Default 1.')(func)
+    func = click.option('--offline', is_flag=True,
+                        help="List branches/tags from local refs instead of asking origin. Doesn't fetch.")(func)
+    func = click.option('--preload', multiple=True,
+                        help='Import this module (e.g. theme or extension) in --worker-pool processes in advance. Can '
+                             'be specified more than once.')(func)
     func = click.option('-p', '--priority', type=click.Choice(('branches', 'tags')),
                         help="Group these kinds of versions at the top (for themes that don't separate them).")(func)
     func = click.option('-r', '--root-ref',
                         help='The branch/tag at the root of DESTINATION. Will also be in subdir. Default master.')(func)
     func = click.option('-s', '--sort', multiple=True, type=click.Choice(('semver', 'alpha', 'time')),
                         help='Sort versions. Specify multiple times to sort equal values of one kind.')(func)
+    func = click.option('--sidebar-mode', type=click.Choice(('inline', 'inject', 'json')),
+                        help='Render versions sidebars and banners while building each version (inline, default), '
+                             'fill them in all HTML files afterwards (inject) or in the browser from versions.json '
+                             '(json).')(func)
+    func = click.option('--sync', is_flag=True,
+                        help='Build into a local temporary directory, then only copy/update/delete files that changed '
+                             'in DESTINATION.')(func)
+    func = click.option('--targeted-fetch', is_flag=True,
+                        help='Only fetch refs whose commits are missing locally instead of running "git fetch origin" '
+                             'first.')(func)
     func = click.option('-t', '--greatest-tag', is_flag=True,
                         help='Override root-ref to be the tag with the highest version number.')(func)
     func = click.option('-T', '--recent-tag', is_flag=True,
@@ -203,6 +253,11 @@ def build_options(func):
                         help='Whitelist branches that match the pattern. Can be specified more than once.')(func)
     func = click.option('-W', '--whitelist-tags', multiple=True,
                         help='Whitelist tags that match the pattern. Can be specified more than once.')(func)
+    func = click.option('--worker-builds', type=click.IntRange(1, None),
+                        help='Replace each --worker-pool process after this many sphinx-build runs. Default 20.')(func)
+    func = click.option('--worker-pool', is_flag=True,
+                        help='Run sphinx-build in processes forked from a server which already imported Sphinx, the '
+                             'theme and extensions.')(func)
     func = click.option('-P', '--pdf-file',
                         help='Name of the generated PDF file.')(func)
     return func
@@ -235,6 +290,49 @@ def override_root_main_ref(config, remotes, banner):
     return ref in [r['name'] for r in remotes]
 
 
+def get_versions(config, remotes):
+    """Instantiate Versions and settle root and banner main refs.
+
+    :raise HandledError: If there are no versions or the root ref isn't one of them. Will be logged before raising.
+
+    :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
+    :param iter remotes: Output of routines.gather_git_info().
+
+    :return: Versions class instance.
+    :rtype: sphinxcontrib.versioning.versions.Versions
+    """
+    log = logging.getLogger(__name__)
+    if not remotes:
+        log.error('No docs found in any remote branch/tag. Nothing to do.')
+        raise HandledError
+    versions = Versions(
+        remotes,
+        sort=config.sort,
+        priority=config.priority,
+        invert=config.invert,
+        pdf_file=config.pdf_file,
+    )
+
+    # Get root ref.
+    if not override_root_main_ref(config, versions.remotes, False):
+        log.error('Root ref %s not found in: %s', config.root_ref, ' '.join(r[1] for r in remotes))
+        raise HandledError
+    log.info('Root ref is: %s', config.root_ref)
+
+    # Get banner main ref.
+    if not config.show_banner:
+        config.update(dict(banner_greatest_tag=False, banner_main_ref=None, banner_recent_tag=False), overwrite=True)
+    elif not override_root_main_ref(config, versions.remotes, True):
+        log.warning('Banner main ref %s not found in: %s', config.banner_main_ref, ' '.join(r[1] for r in remotes))
+        log.warning('Disabling banner.')
+        config.update(dict(banner_greatest_tag=False, banner_main_ref=None, banner_recent_tag=False, show_banner=False),
+                      overwrite=True)
+    else:
+        log.info('Banner main ref is: %s', config.banner_main_ref)
+
+    return versions
+
+
 @cli.command(cls=ClickCommand)
 @build_options
 @click.argument('REL_SOURCE', nargs=-1, required=True)
@@ -257,49 +355,33 @@ def build(config, rel_source, destination, **options):
 
     :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
     :param tuple rel_source: Possible relative paths (to git root) of Sphinx directory containing conf.py (e.g. docs).
-    :param str destination: Destination directory to copy/overwrite built docs to. Does not delete old files.
+    :param str destination: Destination directory to copy/overwrite built docs to. Only deletes old files with sync.
     :param dict options: Additional Click options.
     """
     if 'pre' in config:
         config.pop('pre')(rel_source)
-        config.update({k: v for k, v in options.items() if v})
+        config.update({k: v for k, v in options.items() if v or (v == 0 and v is not False)})  # --cache-size 0
         if config.local_conf:
             config.update(read_local_conf(config.local_conf), ignore_set=True)
     if NO_EXECUTE:
         raise RuntimeError(config, rel_source, destination)
     log = logging.getLogger(__name__)
+    if config.incremental and not config.cache_dir:
+        log.error('--incremental requires --cache-dir.')
+        raise HandledError
+    if config.changes_file and not (config.sync or config.generations):
+        log.error('--changes-file requires --sync or --generations.')
+        raise HandledError
+    if config.generations == 1:
+        log.error('--generations must be at least 2, readers may still be loading pages of the previous one.')
+        raise HandledError
 
     # Gather git data.
     log.info('Gathering info about the remote git repository...')
     conf_rel_paths = [os.path.join(s, 'conf.py') for s in rel_source]
-    remotes = gather_git_info(config.git_root, conf_rel_paths, config.whitelist_branches, config.whitelist_tags)
-    if not remotes:
-        log.error('No docs found in any remote branch/tag. Nothing to do.')
-        raise HandledError
-    versions = Versions(
-        remotes,
-        sort=config.sort,
-        priority=config.priority,
-        invert=config.invert,
-        pdf_file=config.pdf_file,
-    )
-
-    # Get root ref.
-    if not override_root_main_ref(config, versions.remotes, False):
-        log.error('Root ref %s not found in: %s', config.root_ref, ' '.join(r[1] for r in remotes))
-        raise HandledError
-    log.info('Root ref is: %s', config.root_ref)
-
-    # Get banner main ref.
-    if not config.show_banner:
-        config.update(dict(banner_greatest_tag=False, banner_main_ref=None, banner_recent_tag=False), overwrite=True)
-    elif not override_root_main_ref(config, versions.remotes, True):
-        log.warning('Banner main ref %s not found in: %s', config.banner_main_ref, ' '.join(r[1] for r in remotes))
-        log.warning('Disabling banner.')
-        config.update(dict(banner_greatest_tag=False, banner_main_ref=None, banner_recent_tag=False, show_banner=False),
-                      overwrite=True)
-    else:
-        log.info('Banner main ref is: %s', config.banner_main_ref)
+    remotes = gather_git_info(config.git_root, conf_rel_paths, config.whitelist_branches, config.whitelist_tags,
+                              config.blacklist_branches, config.blacklist_tags)
+    versions = get_versions(config, remotes)
 
     # Pre-build.
     log.info("Pre-running Sphinx to collect versions' master_doc and other info.")
@@ -310,11 +392,123 @@ def build(config, rel_source, destination, **options):
                       overwrite=True)
 
     # Build.
-    build_all(exported_root, destination, versions)
+    if config.sync or config.generations:
+        with TempDir() as staging:
+            build_all(exported_root, staging, versions)
+            publish(staging, destination)
+    else:
+        build_all(exported_root, destination, versions)
 
     # Cleanup.
-    log.debug('Removing: %s', exported_root)
-    shutil.rmtree(exported_root)
+    if not config.incremental:
+        log.debug('Removing: %s', exported_root)
+        shutil.rmtree(exported_root)
+    log.info('Git: %d commands (%.2fs), %d long-lived cat-file processes for %d lookups (%.2fs).', STATS['commands'],
+             STATS['command_seconds'], STATS['session_processes'], STATS['session_lookups'], STATS['session_seconds'])
 
     # Store versions in state for push().
     config['versions'] = versions
+
+
+@cli.command(cls=ClickCommand)
+@build_options
+@click.option('--interval', type=click.IntRange(1, None), default=60, help='Seconds between polls. Default 60.')
+@click.argument('REL_SOURCE', nargs=-1, required=True)
+@click.argument('DESTINATION', type=click.Path(file_okay=False, dir_okay=True))
+@click.make_pass_decorator(Config)
+def watch(config, rel_source, destination, interval, **options):
+    """Build all locally, then keep polling branches/tags and rebuild those that changed.
+
+    Runs until interrupted. After the first build only branches/tags whose commit appeared or changed are rebuilt. All
+    versions are rebuilt when the list shown in the sidebars changes (e.g. a new tag or a new document).
+
+    Takes the same options and arguments as the "build" sub command.
+    \f
+
+    :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
+    :param tuple rel_source: Possible relative paths (to git root) of Sphinx directory containing conf.py (e.g. docs).
+    :param str destination: Destination directory to copy/overwrite built docs to. Only deletes old files with sync.
+    :param int interval: Seconds to sleep between polls.
+    :param dict options: Additional Click options.
+    """
+    if 'pre' in config:
+        config.pop('pre')(rel_source)
+        config.update({k: v for k, v in options.items() if v or (v == 0 and v is not False)})  # --cache-size 0
+        if config.local_conf:
+            config.update(read_local_conf(config.local_conf), ignore_set=True)
+    if NO_EXECUTE:
+        raise RuntimeError(config, rel_source, destination, interval)
+    log = logging.getLogger(__name__)
+    if config.incremental and not config.cache_dir:
+        log.error('--incremental requires --cache-dir.')
+        raise HandledError
+    if config.changes_file and not (config.sync or config.generations):
+        log.error('--changes-file requires --sync or --generations.')
+        raise HandledError
+    if config.generations == 1:
+        log.error('--generations must be at least 2, readers may still be loading pages of the previous one.')
+        raise HandledError
+
+    # State kept between polls.
+    conf_rel_paths = [os.path.join(s, 'conf.py') for s in rel_source]
+    refs = ('banner_greatest_tag', 'banner_main_ref', 'banner_recent_tag', 'root_ref', 'show_banner')
+    initial = {k: getattr(config, k) for k in refs}
+    exported_root = None if config.incremental else TempDir(True).name
+    staging = TempDir(True).name if config.sync or config.generations else None  # Mirror of the published build.
+    configs = dict()
+    built, flattened = None, None  # SHAs by version id and Versions.flatten() of the last build.
+    skipped = set()  # (name, sha) of versions that failed, not retried until they change.
+
+    while True:
+        config.update(initial, overwrite=True)
+        log.info('Gathering info about the remote git repository...')
+        try:
+            remotes = gather_git_info(config.git_root, conf_rel_paths, config.whitelist_branches,
+                                      config.whitelist_tags, config.blacklist_branches, config.blacklist_tags, skipped)
+        except HandledError:
+            log.error('Trying again in %d seconds.', interval)
+            time.sleep(interval)
+            continue
+        shas = {'/'.join(r[2:0:-1]): r[0] for r in remotes}
+        if shas != built:
+            try:
+                versions = get_versions(config, remotes)
+                log.info("Pre-running Sphinx to collect versions' master_doc and other info.")
+                exported_root = pre_build(config.git_root, versions, exported_root, configs)
+                if config.banner_main_ref and config.banner_main_ref not in [r['name'] for r in versions.remotes]:
+                    log.warning('Banner main ref %s failed during pre-run. Disabling banner.', config.banner_main_ref)
+                    config.update(dict(banner_greatest_tag=False, banner_main_ref=None, banner_recent_tag=False,
+                                       show_banner=False), overwrite=True)
+
+                # Only rebuild changed versions if the sidebars of the others are still up to date.
+                only = None
+                if built is not None and (versions.flatten() == flattened or config.sidebar_mode != 'inline'):
+                    only = [i for i, sha in shas.items() if built.get(i) != sha]
+                    log.info('Rebuilding changed versions: %s', ' '.join(only))
+                elif built is not None:
+                    log.info('Versions list changed. Rebuilding everything.')
+                build_all(exported_root, staging or destination, versions, only)
+                if staging:
+                    root_remote = versions[config.root_ref]
+                    keep = configs[(root_remote['sha'], root_remote['conf_rel_path'])]['output_names']
+                    prune(staging, list(keep) + [r['root_dir'] for r in versions.remotes])
+                    publish(staging, destination)
+            except HandledError:
+                log.error('Waiting for branches/tags to change before building again.')
+                built, flattened = shas, None
+            else:
+                built, flattened = {r['id']: r['sha'] for r in versions.remotes}, versions.flatten()
+                skipped.update((r[1], r[0]) for r in remotes if '/'.join(r[2:0:-1]) not in built)
+
+            # Forget commits that are gone.
+            current = {(r[0], r[4]) for r in remotes}
+            for key in [k for k in configs if k not in current]:
+                configs.pop(key)
+            if not config.incremental:
+                for sha in set(os.listdir(exported_root)) - {k[0] for k in current}:
+                    shutil.rmtree(os.path.join(exported_root, sha), True)
+        else:
+            log.info('Nothing changed.')
+
+        log.info('Sleeping %d seconds.', interval)
+        time.sleep(interval)
@@ -0,0 +1,153 @@
+/* Render the versions sidebar and banner from versions.json (sphinx-versions --sidebar-mode json). */
+(function () {
+    'use strict';
+
+    var page, toRoot;
+
+    function element(tag, attributes, children) {
+        var node = document.createElement(tag);
+        Object.keys(attributes || {}).forEach(function (name) {
+            node.setAttribute(name, attributes[name]);
+        });
+        (children || []).forEach(function (child) {
+            node.appendChild(typeof child === 'string' ? document.createTextNode(child) : child);
+        });
+        return node;
+    }
+
+    function render(manifest) {
+        var bits = {};
+        manifest.docs.forEach(function (docname, bit) {
+            bits[docname] = bit;
+        });
+        var versions = manifest.versions;
+        var byName = {};
+        versions.forEach(function (version) {
+            byName[version.name] = version;
+        });
+
+        // Same as Versions.vhasdoc(), vpathto() and pathtopdf().
+        function hasDoc(version) {
+            var bit = bits[page.pagename];
+            if (version.name === page.version) {
+                return true;
+            }
+            if (bit === undefined) {
+                return false;
+            }
+            var index = version.found_docs.length - 1 - Math.floor(bit / 4);
+            return index >= 0 && ((parseInt(version.found_docs.charAt(index), 16) >> (bit % 4)) & 1) === 1;
+        }
+        function url(version) {
+            if (version.name === page.version && !page.root) {
+                return page.pagename.split('/').pop() + '.html';
+            }
+            return toRoot + version.root_dir + '/' + (hasDoc(version) ? page.pagename : version.master_doc) + '.html';
+        }
+        function pdfUrl(version) {
+            return toRoot + version.root_dir + '/_static/' + manifest.pdf_file.replace(/\.[^.\/]*$/, '') + '.pdf';
+        }
+        function links(kind, tag, pdf) {
+            return versions.filter(function (version) {
+                return kind === null || version.kind === kind;
+            }).map(function (version) {
+                var attributes = pdf ? {href: pdfUrl(version), download: ''} : {href: url(version)};
+                var link = element('a', attributes, [version.name]);
+                return tag ? element(tag, {}, [link]) : link;
+            });
+        }
+
+        // Sidebar, same markup as versions_list.html.
+        var sidebar;
+        var tags = links('tags', 'dd');
+        var branches = links('heads', 'dd');
+        if (page.theme === 'sphinx_rtd_theme') {
+            var other = element('div', {'class': 'rst-other-versions'});
+            if (tags.length) {
+                other.appendChild(element('dl', {}, [element('dt', {}, ['Tags'])].concat(tags)));
+            }
+            if (branches.length) {
+                other.appendChild(element('dl', {}, [element('dt', {}, ['Branches'])].concat(branches)));
+            }
+            if (manifest.pdf_file) {
+                var pdfs = links('tags', 'dd', true).concat(links('heads', 'dd', true));
+                other.appendChild(element('dl', {}, [element('dt', {}, ['PDF'])].concat(pdfs)));
+            }
+            sidebar = element('div', {'class': 'rst-versions', 'data-toggle': 'rst-versions', role: 'note',
+                                      'aria-label': 'versions'}, [
+                element('span', {'class': 'rst-current-version', 'data-toggle': 'rst-current-version'}, [
+                    element('span', {'class': 'fa fa-book'}, [' Other Versions']),
+                    ' v: ' + page.version + ' ',
+                    element('span', {'class': 'fa fa-caret-down'})
+                ]),
+                other
+            ]);
+        } else if (page.theme === 'rasabaster') {
+            var content = element('div', {'class': 'other-versions'});
+            if (tags.length) {
+                content.appendChild(element('p', {}, ['tags']));
+                content.appendChild(element('div', {'class': 'dropdown-content'}, links('tags')));
+            }
+            if (branches.length) {
+                content.appendChild(element('p', {}, ['branches']));
+                content.appendChild(element('div', {'class': 'dropdown-content'}, links('heads')));
+            }
+            sidebar = element('div', {'class': 'versions'}, [
+                element('p', {'class': 'caption'}, ['Versions']),
+                element('div', {'class': 'versions-content'}, [
+                    element('div', {}, [element('span', {'class': 'current-version'}, ['viewing: ' + page.version])]),
+                    content
+                ])
+            ]);
+        } else {
+            sidebar = element('div', {}, [element('h3', {}, ['Versions']), element('ul', {}, links(null, 'li'))]);
+        }
+        Array.prototype.forEach.call(document.querySelectorAll('.scv-versions'), function (slot) {
+            slot.appendChild(sidebar.cloneNode(true));
+        });
+
+        // Banner, same message as banner.html.
+        var main = byName[manifest.banner_main_ref];
+        if (!main || main.name === page.version || !byName[page.version]) {
+            return;
+        }
+        var classes = 'scv-banner';
+        if (['sphinx_rtd_theme', 'bizstyle', 'classic', 'traditional'].indexOf(page.theme) !== -1) {
+            classes += ' scv-' + page.theme;
+        }
+        var kind = byName[page.version].kind === 'heads' ? 'the development' : 'an old';
+        var message = [element('b', {}, ['Warning:']),
+                       ' This document is for ' + kind + ' version of ' + page.project + '.'];
+        if (hasDoc(main)) {
+            message.push(' The ' + (main.kind === 'tags' ? 'latest' : 'main') + ' version is ' + main.name + '.');
+            message = [element('a', {href: url(main)}, message)];
+        }
+        var banner = element('p', {'class': classes}, message);
+        Array.prototype.forEach.call(document.querySelectorAll('.scv-banner-slot'), function (slot) {
+            slot.appendChild(banner.cloneNode(true));
+        });
+    }
+
+    function start() {
+        var meta = document.querySelector('meta[name="scv-versions"]');
+        if (!meta) {
+            return;
+        }
+        page = JSON.parse(meta.getAttribute('content'));
+        toRoot = new Array(page.pagename.split('/').length).join('../') + (page.root ? '' : '../');
+        var request = new XMLHttpRequest();
+        request.onload = function () {
+            if (request.status >= 200 && request.status < 300) {
+                render(JSON.parse(request.responseText));
+            }
+        };
+        request.open('GET', toRoot + 'versions.json');
+        request.send();
+    }
+
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', start);
+    } else {
+        start();
+    }
+}());
@@ -0,0 +1,249 @@
+"""Persistent on-disk caches kept between runs."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import sphinx
+
+from sphinxcontrib.versioning import __version__
+from sphinxcontrib.versioning.git import batch_check, filter_and_date
+from sphinxcontrib.versioning.lib import copy_tree
+
+# Config attributes that don't affect built HTML.
+# Retention policies only change which versions are built, which is part of the key through Versions.flatten().
+IGNORED_CONFIG = ('blob_store', 'cache_dir', 'cache_size', 'changes_file', 'chdir', 'explain_cache', 'generations',
+                  'git_root', 'incremental', 'jobs', 'keep_branches', 'keep_patches', 'keep_tags_since', 'local_conf',
+                  'no_colors', 'no_local_conf', 'offline', 'preload', 'sync', 'targeted_fetch', 'verbose',
+                  'worker_builds', 'worker_pool')
+REASONS = dict(
+    config='config changed',
+    tree='docs tree or export paths changed',
+    version='sphinx-versions/Sphinx version changed',
+    versions='versions list changed',
+)
+
+
+def tree_hashes(local_root, remotes, extra_paths=()):
+    """Get the git tree hash of every remote's REL_SOURCE directory (the one holding its conf.py).
+
+    Object hashes of extra paths (e.g. the export_paths setting) are appended, "missing" for paths not in a commit.
+
+    :param str local_root: Local path to git root directory.
+    :param iter remotes: List of dicts from Versions.remotes.
+    :param iter extra_paths: Other files/directories the build reads, relative to the git root.
+
+    :return: Tree SHA (None if missing) for each remote's id, followed by "path=sha" pairs of extra paths if any.
+    :rtype: dict
+    """
+    remotes = list(remotes)
+    paths = [p for p in (p.replace(os.sep, '/').strip('/') for p in extra_paths) if p]
+    objects = list()
+    for remote in remotes:
+        objects.append('{0}:{1}'.format(remote['sha'], os.path.dirname(remote['conf_rel_path']).replace(os.sep, '/')))
+        objects.extend('{0}:{1}'.format(remote['sha'], p) for p in paths)
+    found = [(f[0] if f else None) for f in batch_check(local_root, objects)]
+    hashes = dict()
+    for i, remote in enumerate(remotes):
+        tree, extra = found[i * (len(paths) + 1)], found[i * (len(paths) + 1) + 1:(i + 1) * (len(paths) + 1)]
+        if paths:
+            tree = ' '.join([str(tree)] + ['{0}={1}'.format(p, e or 'missing') for p, e in zip(paths, extra)])
+        hashes[remote['id']] = tree
+    return hashes
+
+
+class CommitCache(object):
+    """Facts that never change for a commit: its timestamp and which conf.py candidate it has (if any).
+
+    Kept between runs in an append-only file of JSON lines, one line per commit and list of conf.py candidates. Commits
+    without docs are stored too so they're never looked up again.
+
+    :ivar str path: JSON lines file.
+    :ivar tuple conf_rel_paths: conf.py candidates of this run, only lines for the same candidates are used.
+    :ivar dict commits: filter_and_date() values by SHA, None for commits without docs.
+    """
+
+    def __init__(self, path, conf_rel_paths):
+        """Constructor.
+
+        :param str path: JSON lines file. Created on first write.
+        :param iter conf_rel_paths: List of possible relative paths (to git root) of Sphinx conf.py.
+        """
+        self.path = path
+        self.conf_rel_paths = tuple(p.replace(os.sep, '/') for p in conf_rel_paths)
+        self.commits = dict()
+        try:
+            with open(path) as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line.
+                    if tuple(record['paths']) == self.conf_rel_paths:
+                        self.commits[record['sha']] = record['value']
+        except (IOError, OSError):
+            pass
+
+    def filter_and_date(self, local_root, commits, dates=None):
+        """Same as git.filter_and_date() but only ask git about commits not in the cache, then add them to it.
+
+        :raise CalledProcessError: Unhandled git command failure.
+        :raise GitError: A commit SHA has not been fetched.
+
+        :param str local_root: Local path to git root directory.
+        :param iter commits: List of commit SHAs.
+        :param dict dates: Already known commit times by SHA.
+
+        :return: Commit time (seconds since Unix epoch) and conf.py path of each commit. SHA keys, [int, str] values.
+        :rtype: dict
+        """
+        commits = list(dict((c, None) for c in commits))  # Unique, order preserved.
+        unknown = [c for c in commits if c not in self.commits]
+        log = logging.getLogger(__name__)
+        log.debug('Commit cache: %d known, %d unknown commits.', len(commits) - len(unknown), len(unknown))
+        if unknown:
+            found = filter_and_date(local_root, self.conf_rel_paths, unknown, dates)
+            new = [(c, found.get(c)) for c in unknown]
+            self.commits.update(new)
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path, 'a') as handle:
+                lines = (json.dumps(dict(paths=self.conf_rel_paths, sha=c, value=v)) + '\n' for c, v in new)
+                handle.write(''.join(lines))
+        return {c: list(self.commits[c]) for c in commits if self.commits[c] is not None}
+
+
+class BuildCache(object):
+    """Built HTML of previous runs, one directory per build key. Least recently used entries are evicted.
+
+    A build key combines the git tree hash of the version's REL_SOURCE directory (and of export_paths), effective
+    config values, sphinx-versions and Sphinx versions, and all versions as seen by the sidebar (Versions.flatten(),
+    only with the inline sidebar mode).
+
+    :ivar str path: Directory holding the cache entries and index.json.
+    :ivar int max_size: Evict entries until total size is below this many bytes. 0 disables eviction.
+    :ivar dict index: Entries (size and last use) and the last key components of each build.
+    """
+
+    def __init__(self, path, max_size):
+        """Constructor.
+
+        :param str path: Directory holding the cache entries and index.json. Created if missing.
+        :param int max_size: Evict entries until total size is below this many bytes. 0 disables eviction.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.index = dict(entries=dict(), builds=dict())
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        try:
+            with open(os.path.join(path, 'index.json')) as handle:
+                self.index.update(json.load(handle))
+        except (IOError, OSError, ValueError):
+            pass
+
+    @staticmethod
+    def components(remote, is_root, versions, config, tree):
+        """Gather everything the built HTML of one version depends on.
+
+        :param dict remote: Version being built, from Versions.remotes.
+        :param bool is_root: Is this build in the web root?
+        :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+        :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
+        :param str tree: Git tree SHA of the version's REL_SOURCE directory, from tree_hashes().
+
+        :return: JSON serializable key components, see REASONS for keys.
+        :rtype: dict
+        """
+        return dict(
+            config=json.dumps({k: v for k, v in config if k not in IGNORED_CONFIG}, sort_keys=True, default=repr),
+            tree='{0} {1} {2} {3}'.format(tree, remote['conf_rel_path'], remote['id'], is_root),
+            version='{0} {1}'.format(__version__, sphinx.__version__),
+            versions=json.dumps(versions.flatten(), default=repr) if config.sidebar_mode == 'inline' else '',
+        )
+
+    @staticmethod
+    def key(components):
+        """Hash key components into a build key.
+
+        :param dict components: Return value of components().
+
+        :return: Hex digest.
+        :rtype: str
+        """
+        return hashlib.sha256(json.dumps(components, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def explain(self, name, components):
+        """Explain why a build can't be reused.
+
+        :param str name: Build name (e.g. heads/master or heads/master (root)).
+        :param dict components: Return value of components().
+
+        :return: Human readable reasons, None if the build is in the cache.
+        :rtype: str
+        """
+        key = self.key(components)
+        if key in self.index['entries'] and os.path.isdir(os.path.join(self.path, key)):
+            return None
+        previous = self.index['builds'].get(name)
+        if not previous:
+            return 'never built'
+        changed = [REASONS[k] for k in sorted(REASONS) if previous['components'].get(k) != components[k]]
+        return ', '.join(changed) or 'evicted from cache'
+
+    def restore(self, key, target):
+        """Copy a cached build into target and mark it as recently used.
+
+        :param str key: Build key.
+        :param str target: Directory to copy into.
+        """
+        copy_tree(os.path.join(self.path, key), target)
+        self.index['entries'][key]['used'] = time.time()
+
+    def staging(self):
+        """Create an empty directory in the cache to build into. Becomes an entry in store().
+
+        :return: Directory path.
+        :rtype: str
+        """
+        return tempfile.mkdtemp('.staging', dir=self.path)
+
+    def store(self, name, components, staging):
+        """Turn a staging directory into a cache entry.
+
+        :param str name: Build name (e.g. heads/master or heads/master (root)).
+        :param dict components: Return value of components().
+        :param str staging: Directory from staging() holding the built HTML.
+
+        :return: Path to the cache entry.
+        :rtype: str
+        """
+        key = self.key(components)
+        path = os.path.join(self.path, key)
+        shutil.rmtree(os.path.join(staging, '.doctrees'), True)
+        shutil.rmtree(path, True)
+        os.rename(staging, path)
+        size = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(path) for f in fs)
+        self.index['entries'][key] = dict(size=size, used=time.time())
+        self.index['builds'][name] = dict(components=components, key=key)
+        return path
+
+    def save(self):
+        """Evict least recently used entries above max_size and write the index to disk."""
+        log = logging.getLogger(__name__)
+        entries = self.index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['used']):
+            if not self.max_size or total <= self.max_size:
+                break
+            log.debug('Evicting build cache entry %s.', key)
+            shutil.rmtree(os.path.join(self.path, key), True)
+            total -= entries.pop(key)['size']
+        temp_path = os.path.join(self.path, 'index.json.tmp')
+        with open(temp_path, 'w') as handle:
+            json.dump(self.index, handle)
+        os.replace(temp_path, os.path.join(self.path, 'index.json'))
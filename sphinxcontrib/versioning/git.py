@@ -1,21 +1,24 @@
 """Interface with git locally and remotely."""
 
+import atexit
 import glob
 import json
 import logging
 import os
 import re
+import shutil
+import stat
 import sys
 import tarfile
 import time
 from datetime import datetime
-from subprocess import CalledProcessError, PIPE, Popen, STDOUT
+from subprocess import CalledProcessError, DEVNULL, PIPE, Popen, STDOUT
 
 IS_WINDOWS = sys.platform == 'win32'
 RE_ALL_REMOTES = re.compile(r'([\w./-]+)\t([A-Za-z0-9@:/\\._-]+) \((fetch|push)\)\n')
 RE_REMOTE = re.compile(r'^(?P<sha>[0-9a-f]{5,40})\trefs/(?P<kind>heads|tags)/(?P<name>[\w./-]+(?:\^\{})?)$',
                        re.MULTILINE)
-RE_UNIX_TIME = re.compile(r'^\d{10}$', re.MULTILINE)
+STATS = dict(commands=0, command_seconds=0.0, session_processes=0, session_lookups=0, session_seconds=0.0)
 WHITELIST_ENV_VARS = (
     'APPVEYOR',
     'APPVEYOR_ACCOUNT_NAME',
@@ -112,7 +115,171 @@ def chunk(iterator, max_size):
         yield chunked
 
 
-def run_command(local_root, command, env_var=True, pipeto=None, retry=0, environ=None):
+def git_env(local_root, env_var=True, environ=None):
+    """Get environment variables for git commands.
+
+    :param str local_root: Local path to git root directory.
+    :param bool env_var: Define GIT_DIR environment variable (on non-Windows).
+    :param dict environ: Environment variables to set/override in the command.
+
+    :return: Environment variables.
+    :rtype: dict
+    """
+    env = os.environ.copy()
+    if environ:
+        env.update(environ)
+    if env_var and not IS_WINDOWS:
+        git_dir = os.path.join(local_root, '.git')
+        env['GIT_DIR'] = git_dir if os.path.exists(git_dir) else local_root  # Bare repository otherwise.
+    else:
+        env.pop('GIT_DIR', None)
+    return env
+
+
+class GitSession(object):
+    """Long-lived "git cat-file --batch-check" and "git cat-file --batch" processes of one repository.
+
+    Object lookups are written to the same processes instead of starting new ones. Processes start on first use and
+    are stopped by close(), or at exit. Child processes forked after a session started get their own session.
+
+    :ivar str local_root: Local path to git root directory.
+    :ivar int pid: Process ID that started this session's processes.
+    """
+
+    SESSIONS = dict()
+
+    def __init__(self, local_root):
+        """Constructor.
+
+        :param str local_root: Local path to git root directory.
+        """
+        self.local_root = local_root
+        self.pid = os.getpid()
+        self._processes = dict()
+
+    @classmethod
+    def get(cls, local_root):
+        """Get the session of a repository, starting a new one if needed.
+
+        :param str local_root: Local path to git root directory.
+
+        :return: Session instance.
+        :rtype: GitSession
+        """
+        session = cls.SESSIONS.get(local_root)
+        if session is None or session.pid != os.getpid():
+            session = cls.SESSIONS[local_root] = cls(local_root)
+        return session
+
+    @classmethod
+    def close_all(cls):
+        """Stop processes of all sessions started by this process."""
+        for session in cls.SESSIONS.values():
+            if session.pid == os.getpid():
+                session.close()
+        cls.SESSIONS.clear()
+
+    def close(self):
+        """Stop this session's processes. They're started again when needed."""
+        for process in self._processes.values():
+            process.stdin.close()
+            process.wait()
+            process.stdout.close()
+        self._processes.clear()
+
+    def _process(self, mode):
+        """Get a running "git cat-file" process.
+
+        :param str mode: Either batch or batch-check.
+
+        :return: Process with stdin and stdout pipes.
+        :rtype: subprocess.Popen
+        """
+        process = self._processes.get(mode)
+        if process is None or process.poll() is not None:
+            command = ['git', 'cat-file', '--' + mode]
+            logging.getLogger(__name__).debug('Starting %s in %s', ' '.join(command), self.local_root)
+            process = Popen(command, cwd=self.local_root, env=git_env(self.local_root), stdin=PIPE, stdout=PIPE,
+                            stderr=DEVNULL)
+            STATS['session_processes'] += 1
+            self._processes[mode] = process
+        return process
+
+    def _readline(self, process, mode):
+        """Read one line of "git cat-file" output.
+
+        :raise CalledProcessError: Process exited.
+
+        :param subprocess.Popen process: Process to read from.
+        :param str mode: Either batch or batch-check.
+
+        :return: Line without LF.
+        :rtype: str
+        """
+        line = process.stdout.readline()
+        if not line:
+            self._processes.pop(mode, None)
+            raise CalledProcessError(process.wait(), ['git', 'cat-file', '--' + mode])
+        return line.decode('utf-8').rstrip('\n')
+
+    def check(self, objects):
+        """Look up many git objects (e.g. "<sha>" or "<sha>:<path>").
+
+        Objects are written in chunks and their results read before writing more, so neither pipe fills up.
+
+        :raise CalledProcessError: Unhandled git command failure.
+
+        :param iter objects: Object names, one per lookup.
+
+        :return: Tuple of (sha, type) for each object in the same order. None for missing or ambiguous objects.
+        :rtype: list
+        """
+        start = time.time()
+        process = self._process('batch-check')
+        found = list()
+        for objects_chunk in chunk(objects, 100):
+            process.stdin.write(''.join(o + '\n' for o in objects_chunk).encode('utf-8'))
+            process.stdin.flush()
+            for _ in objects_chunk:
+                line = self._readline(process, 'batch-check')
+                if line.endswith((' missing', ' ambiguous')):  # Line is "<object> missing" or "<sha> <type> <size>".
+                    found.append(None)
+                else:
+                    found.append(tuple(line.split(' ')[:2]))
+        STATS['session_lookups'] += len(found)
+        STATS['session_seconds'] += time.time() - start
+        return found
+
+    def read(self, obj):
+        """Read the contents of a git object.
+
+        :raise CalledProcessError: Unhandled git command failure.
+
+        :param str obj: Object name (e.g. "<sha>" or "<sha>:<path>").
+
+        :return: Tuple of (type, contents bytes). None if missing or ambiguous.
+        :rtype: tuple
+        """
+        start = time.time()
+        process = self._process('batch')
+        process.stdin.write((obj + '\n').encode('utf-8'))
+        process.stdin.flush()
+        header = self._readline(process, 'batch')
+        if header.endswith((' missing', ' ambiguous')):
+            data = None
+        else:
+            _, kind, size = header.split(' ')
+            data = kind, process.stdout.read(int(size))
+            process.stdout.read(1)  # Trailing LF.
+        STATS['session_lookups'] += 1
+        STATS['session_seconds'] += time.time() - start
+        return data
+
+
+atexit.register(GitSession.close_all)
+
+
+def run_command(local_root, command, env_var=True, pipeto=None, retry=0, environ=None, stdin=None):
     """Run a command and return the output.
 
     :raise CalledProcessError: Command exits non-zero.
@@ -121,45 +288,47 @@ def run_command(local_root, command, env_var=True, pipeto=None, retry=0, environ
     :param iter command: Command to run.
     :param dict environ: Environment variables to set/override in the command.
     :param bool env_var: Define GIT_DIR environment variable (on non-Windows).
-    :param function pipeto: Pipe `command`'s stdout to this function (only parameter given).
+    :param function pipeto: Pipe `command`'s stdout to this function (only parameter given). If it returns True the
+        command is killed and its exit code ignored (function got everything it needed).
     :param int retry: Retry this many times on CalledProcessError after 0.1 seconds.
+    :param str stdin: Write this to the command's stdin instead of /dev/null. Not with pipeto.
 
     :return: Command output.
     :rtype: str
     """
     log = logging.getLogger(__name__)
-
-    # Setup env.
-    env = os.environ.copy()
-    if environ:
-        env.update(environ)
-    if env_var and not IS_WINDOWS:
-        env['GIT_DIR'] = os.path.join(local_root, '.git')
-    else:
-        env.pop('GIT_DIR', None)
+    start = time.time()
+    env = git_env(local_root, env_var, environ)
 
     # Run command.
     with open(os.devnull) as null:
-        main = Popen(command, cwd=local_root, env=env, stdout=PIPE, stderr=PIPE if pipeto else STDOUT, stdin=null)
+        main = Popen(command, cwd=local_root, env=env, stdout=PIPE, stderr=PIPE if pipeto else STDOUT,
+                     stdin=null if stdin is None else PIPE)
+        stopped = False
         if pipeto:
-            pipeto(main.stdout)
+            stopped = bool(pipeto(main.stdout))
+            if stopped:
+                main.kill()
             main_output = main.communicate()[1].decode('utf-8')  # Might deadlock if stderr is written to a lot.
         else:
-            main_output = main.communicate()[0].decode('utf-8')
+            main_output = main.communicate(None if stdin is None else stdin.encode('utf-8'))[0].decode('utf-8')
     log.debug(json.dumps(dict(cwd=local_root, command=command, code=main.poll(), output=main_output)))
+    STATS['commands'] += 1
+    STATS['command_seconds'] += time.time() - start
 
     # Verify success.
-    if main.poll() != 0:
+    if main.poll() != 0 and not stopped:
         if retry < 1:
             raise CalledProcessError(main.poll(), command, output=main_output)
         time.sleep(0.1)
-        return run_command(local_root, command, env_var, pipeto, retry - 1)
+        return run_command(local_root, command, env_var, pipeto, retry - 1, environ, stdin)
 
     return main_output
 
 
 def get_root(directory):
-    """Get root directory of the local git repo from any subdirectory within it.
+    """Get root directory of the local git repo from any subdirectory within it. For bare repositories that's the git
+    directory itself.
 
     :raise GitError: If git command fails (dir not a git repo?).
 
@@ -172,7 +341,14 @@ def get_root(directory):
     try:
         output = run_command(directory, command, env_var=False)
     except CalledProcessError as exc:
-        raise GitError('Failed to find local git repository root in {}.'.format(repr(directory)), exc.output)
+        try:
+            bare = run_command(directory, ['git', 'rev-parse', '--is-bare-repository', '--absolute-git-dir'],
+                               env_var=False).splitlines()
+        except CalledProcessError:
+            bare = None
+        if not bare or bare[0] != 'true':
+            raise GitError('Failed to find local git repository root in {}.'.format(repr(directory)), exc.output)
+        output = bare[1]
     if IS_WINDOWS:
         output = output.replace('/', '\\')
     return output.strip()
@@ -209,68 +385,212 @@ def list_remote(local_root):
     return [[i['sha'], i['name'], i['kind']] for i in parsed]
 
 
-def filter_and_date(local_root, conf_rel_paths, commits):
+def list_local(local_root):
+    """Get branch/tag latest SHAs and commit dates from local refs with a single "git for-each-ref", without contacting
+    the remote.
+
+    Branches are origin's remote tracking branches (refs/remotes/origin/*). If there are none (e.g. bare mirror
+    repositories) local branches (refs/heads/*) are used instead.
+
+    :raise GitError: When git for-each-ref fails.
+
+    :param str local_root: Local path to git root directory.
+
+    :return: List of lists. Each is sha (annotated tags dereferenced), name, kind, committer date (Unix time).
+    :rtype: list
+    """
+    command = ['git', 'for-each-ref', '--format=%(objectname)%09%(*objectname)%09%(committerdate:raw)%09'
+               '%(*committerdate:raw)%09%(refname)', 'refs/heads', 'refs/remotes/origin', 'refs/tags']
+    try:
+        output = run_command(local_root, command)
+    except CalledProcessError as exc:
+        raise GitError('Git failed to list local refs.', exc.output)
+
+    refs = dict(heads=list(), origin=list(), tags=list())
+    for line in output.splitlines():
+        sha, peeled_sha, date, peeled_date, refname = line.split('\t')
+        sha, date = (peeled_sha, peeled_date) if peeled_sha else (sha, date)  # Dereference annotated tags.
+        if not date:
+            continue  # Not a commit (e.g. tag of a tree).
+        kind, name = refname[5:].split('/', 1)
+        if kind == 'remotes':
+            kind, name = 'origin', name[7:]
+            if name == 'HEAD':
+                continue
+        refs[kind].append([sha, name, 'tags' if kind == 'tags' else 'heads', int(date.split(' ')[0])])
+
+    return (refs['origin'] or refs['heads']) + refs['tags']
+
+
+def batch_check(local_root, objects):
+    """Look up many git objects (e.g. "<sha>" or "<sha>:<path>") with the repository's long-lived GitSession.
+
+    :raise CalledProcessError: Unhandled git command failure.
+
+    :param str local_root: Local path to git root directory.
+    :param iter objects: Object names, one per lookup.
+
+    :return: Tuple of (sha, type) for each object in the same order. None for missing or ambiguous objects.
+    :rtype: list
+    """
+    return GitSession.get(local_root).check(objects)
+
+
+def filter_and_date(local_root, conf_rel_paths, commits, dates=None):
     """Get commit Unix timestamps and first matching conf.py path. Exclude commits with no conf.py file.
 
+    Looks up every commit and "<commit>:<conf_rel_path>" candidate with a single "git cat-file --batch-check" process
+    and every timestamp with a single "git log" process, no matter how many commits there are.
+
     :raise CalledProcessError: Unhandled git command failure.
     :raise GitError: A commit SHA has not been fetched.
 
     :param str local_root: Local path to git root directory.
     :param iter conf_rel_paths: List of possible relative paths (to git root) of Sphinx conf.py (e.g. docs/conf.py).
     :param iter commits: List of commit SHAs.
+    :param dict dates: Already known commit times (e.g. from list_local()) by SHA, not looked up again.
 
     :return: Commit time (seconds since Unix epoch) for each commit and conf.py path. SHA keys and [int, str] values.
     :rtype: dict
     """
     dates_paths = dict()
+    conf_rel_paths = [p.replace(os.sep, '/') for p in conf_rel_paths]
+    commits = list(dict((c, None) for c in commits))  # Unique, order preserved.
 
-    # Filter without docs.
+    # Filter without docs. Each commit is followed by its conf.py candidates.
+    objects = [o for c in commits for o in [c] + ['{0}:{1}'.format(c, p) for p in conf_rel_paths]]
+    found = iter(batch_check(local_root, objects))
     for commit in commits:
+        if next(found) is None:
+            raise GitError('Git cat-file failed on {0}'.format(commit), '{0} missing'.format(commit))
+        for conf_rel_path in conf_rel_paths:
+            obj = next(found)
+            if obj and obj[1] == 'blob' and commit not in dates_paths:
+                dates_paths[commit] = [(dates or dict()).get(commit), conf_rel_path]
+    unknown = [c for c, v in dates_paths.items() if v[0] is None]
+    if not unknown:
+        return dates_paths
+
+    # Get all timestamps at once.
+    command = ['git', 'log', '--no-walk=unsorted', '--stdin', '--format=%H %ct']
+    output = run_command(local_root, command, stdin='\n'.join(unknown) + '\n')
+    for line in output.splitlines():
+        commit, timestamp = line.split()
         if commit in dates_paths:
-            continue
-        command = ['git', 'ls-tree', '--name-only', '-r', commit] + conf_rel_paths
-        try:
-            output = run_command(local_root, command)
-        except CalledProcessError as exc:
-            raise GitError('Git ls-tree failed on {0}'.format(commit), exc.output)
-        if output:
-            dates_paths[commit] = [None, output.splitlines()[0].strip()]
-
-    # Get timestamps by groups of 50.
-    command_prefix = ['git', 'show', '-s', '--pretty=format:%ct']
-    for commits_group in chunk(dates_paths, 50):
-        command = command_prefix + commits_group
-        output = run_command(local_root, command)
-        timestamps = [int(i) for i in RE_UNIX_TIME.findall(output)]
-        for i, commit in enumerate(commits_group):
-            dates_paths[commit][0] = timestamps[i]
+            dates_paths[commit][0] = int(timestamp)
 
     # Done.
     return dates_paths
 
 
-def fetch_commits(local_root, remotes):
+def fetch_commits(local_root, remotes, fetch_all=True):
     """Fetch from origin.
 
+    Commits missing from the local repository are found with a single "git cat-file --batch-check" process, then
+    fetched by their refs with one "git fetch" call (per 500 refs, to keep the command line short).
+
     :raise CalledProcessError: Unhandled git command failure.
 
     :param str local_root: Local path to git root directory.
     :param iter remotes: Output of list_remote().
+    :param bool fetch_all: Run "git fetch origin" first to update all remote tracking branches.
     """
+    log = logging.getLogger(__name__)
+    remotes = list(remotes)
+
     # Fetch all known branches.
-    command = ['git', 'fetch', 'origin']
-    run_command(local_root, command)
+    if fetch_all:
+        run_command(local_root, ['git', 'fetch', 'origin'])
 
     # Fetch new branches/tags.
-    for sha, name, kind in remotes:
-        try:
-            run_command(local_root, ['git', 'reflog', sha])
-        except CalledProcessError:
-            run_command(local_root, command + ['refs/{0}/{1}'.format(kind, name)])
-            run_command(local_root, ['git', 'reflog', sha])
+    found = batch_check(local_root, (r[0] for r in remotes))
+    refspecs = ['refs/{0}/{1}'.format(kind, name) for (_, name, kind), f in zip(remotes, found) if not f]
+    for refspecs_chunk in chunk(refspecs, 500):
+        log.debug('Fetching %d refs with missing commits.', len(refspecs_chunk))
+        run_command(local_root, ['git', 'fetch', 'origin'] + refspecs_chunk)
+    if refspecs:
+        GitSession.get(local_root).close()  # Look up fetched objects with new processes.
+
+
+def last_committed(local_root, commit, file_paths):
+    """Get the Unix timestamp (author date) of the last commit that touched each file.
+
+    Walks history once with a streamed "git log --name-only" and stops as soon as every file has been seen. Merges list
+    their files against each parent (-m) and count for files that differ from all parents, like "git log -n1 -- file"
+    shows them. Files not seen in the walk fall back to one "git log -n1" each.
+
+    :raise CalledProcessError: Unhandled git command failure.
+
+    :param str local_root: Local path to git root directory.
+    :param str commit: Git commit SHA to start walking from.
+    :param iter file_paths: Paths relative to the git root, with forward slashes.
+
+    :return: Timestamp for each file path.
+    :rtype: dict
+    """
+    pending = set(file_paths)
+    timestamps = dict()
+    if not pending:
+        return timestamps
+
+    # Define reader function.
+    def resolve(timestamp, names):
+        """Record the timestamp of files changed by one commit.
 
+        :param int timestamp: Author date of the commit.
+        :param set names: Files changed by the commit.
 
-def export(local_root, commit, target):
+        :return: True once all files are resolved.
+        :rtype: bool
+        """
+        for name in names & pending:
+            pending.remove(name)
+            timestamps[name] = timestamp
+        return not pending
+
+    def read(stdout):
+        """Parse NUL delimited "git log -z" output. Tokens are either a 0x01 byte followed by the SHA and timestamp or
+        file names. Merges repeat their header for each parent.
+
+        :param file stdout: Handle to git's stdout pipe.
+
+        :return: True to stop git once all files are resolved.
+        :rtype: bool
+        """
+        sha, timestamp, names, parent_names, remainder = None, None, set(), None, b''
+        for data in iter(lambda: stdout.read1(65536), b''):
+            tokens = (remainder + data).split(b'\0')
+            remainder = tokens.pop()
+            for token in tokens:
+                if not token.startswith(b'\x01'):
+                    name = token.decode('utf-8', 'surrogateescape')
+                    names.add(name[1:] if name.startswith('\n') else name)
+                    continue
+                # Next header: same SHA for the next parent of a merge, else the previous commit is complete.
+                parent_names = names if parent_names is None else parent_names & names
+                next_sha, next_timestamp = token[1:].split(b' ')
+                if next_sha != sha:
+                    if sha is not None and resolve(timestamp, parent_names):
+                        return True
+                    parent_names = None
+                sha, timestamp, names = next_sha, int(next_timestamp), set()
+        if sha is not None:
+            resolve(timestamp, names if parent_names is None else parent_names & names)
+        return not pending
+
+    # Run command.
+    command = ['git', 'log', '-z', '-m', '--name-only', '--format=%x01%H %at', commit, '--', ':(icase)*.rst']
+    run_command(local_root, command, pipeto=read)
+
+    # Fall back for files not found in the walk.
+    for file_path in sorted(pending):
+        output = run_command(local_root, ['git', 'log', '-n1', '--format=%at', commit, '--', file_path])
+        timestamps[file_path] = int(output) if output.strip() else None
+
+    return timestamps
+
+
+def export(local_root, commit, target, paths=None):
     """Export git commit to directory. "Extracts" all files at the commit to the target directory.
 
     Set mtime of RST files to last commit date.
@@ -280,6 +600,7 @@ def export(local_root, commit, target):
     :param str local_root: Local path to git root directory.
     :param str commit: Git commit SHA to export.
     :param str target: Directory to export to.
+    :param iter paths: Only export these files/directories (relative to the git root, must exist). None for all.
     """
     log = logging.getLogger(__name__)
     target = os.path.realpath(target)
@@ -315,12 +636,105 @@ def export(local_root, commit, target):
             log.debug('Failed to extract output from "git archive" command: %s', str(exc))
 
     # Run command.
-    run_command(local_root, ['git', 'archive', '--format=tar', commit], pipeto=extract)
+    command = ['git', 'archive', '--format=tar', commit]
+    if paths is not None:
+        command += ['--'] + list(paths)
+    run_command(local_root, command, pipeto=extract)
+
+    # Set mtime.
+    for file_path, timestamp in last_committed(local_root, commit, mtimes).items():
+        if timestamp is not None:
+            os.utime(os.path.join(target, file_path), (timestamp, timestamp))
+
+
+def export_linked(local_root, commit, target, store, paths=None):
+    """Export git commit to directory like export() but hardlink files from a content-addressed store of git blobs.
+
+    Blobs missing from the store are written to it first, read through the long-lived GitSession.
+    Store files are read-only so nothing writing to exported files can alter other versions. RST files are copied
+    instead of linked since their mtime is set to their last commit date, which differs between versions.
+
+    :raise CalledProcessError: Unhandled git command failure.
+
+    :param str local_root: Local path to git root directory.
+    :param str commit: Git commit SHA to export.
+    :param str target: Directory to export to.
+    :param str store: Directory holding blobs, named after their SHA.
+    :param iter paths: Only export these files/directories (relative to the git root, must exist). None for all.
+    """
+    log = logging.getLogger(__name__)
+    target = os.path.realpath(target)
+    mtimes = list()
+
+    # List files.
+    command = ['git', 'ls-tree', '-r', '-z', '--full-tree', commit]
+    if paths is not None:
+        command += ['--'] + list(paths)
+    output = run_command(local_root, command)
+    entries = list()
+    for line in (i for i in output.split('\0') if i):
+        meta, path = line.split('\t', 1)
+        mode, kind, sha = meta.split(' ')
+        entries.append((mode, kind, sha, path))
+
+    def blob_path(mode, sha):
+        """Get the path of a blob in the store. Executable files are stored separately since links share modes.
+
+        :param str mode: Git file mode.
+        :param str sha: Blob SHA.
+
+        :return: File path.
+        :rtype: str
+        """
+        return os.path.join(store, sha[:2], sha[2:] + ('x' if mode == '100755' else ''))
+
+    # Write missing blobs to the store.
+    missing = dict()
+    for mode, kind, sha, _ in entries:
+        if kind == 'blob' and not os.path.exists(blob_path(mode, sha)):
+            missing.setdefault(sha, set()).add(mode)
+
+    if missing:
+        log.debug('Writing %d new blobs to %s.', len(missing), store)
+    session = GitSession.get(local_root)
+    for sha, modes in missing.items():
+        found = session.read(sha)
+        if found is None:
+            raise CalledProcessError(128, ['git', 'cat-file', '--batch'], output='{0} missing'.format(sha))
+        for mode in modes:
+            path = blob_path(mode, sha)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'wb') as handle:
+                handle.write(found[1])
+            executable = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH if mode == '100755' else 0
+            os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH | executable)
+            os.replace(temp_path, path)
+
+    # Link files.
+    for mode, kind, sha, path in entries:
+        destination = os.path.join(target, path)
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        if kind == 'commit':  # Submodule, like git archive.
+            os.makedirs(destination)
+        elif mode == '120000':  # Symlink, the blob holds the link target.
+            with open(blob_path(mode, sha), 'rb') as handle:
+                os.symlink(handle.read().decode('utf-8'), destination)
+        elif os.path.splitext(path)[1].lower() == '.rst':
+            shutil.copyfile(blob_path(mode, sha), destination)
+            mtimes.append(path)
+        else:
+            try:
+                os.link(blob_path(mode, sha), destination)
+            except OSError:  # Different file system or no hardlink support.
+                shutil.copy2(blob_path(mode, sha), destination)
 
     # Set mtime.
-    for file_path in mtimes:
-        last_committed = int(run_command(local_root, ['git', 'log', '-n1', '--format=%at', commit, '--', file_path]))
-        os.utime(os.path.join(target, file_path), (last_committed, last_committed))
+    for file_path, timestamp in last_committed(local_root, commit, mtimes).items():
+        if timestamp is not None:
+            os.utime(os.path.join(target, file_path), (timestamp, timestamp))
 
 
 def clone(local_root, new_root, remote, branch, rel_dest, exclude):
@@ -0,0 +1,135 @@
+"""Fill in versions sidebars and banners after all versions are built (inject and json sidebar modes)."""
+
+import json
+import logging
+import multiprocessing
+import os
+
+import jinja2
+
+from sphinxcontrib.versioning.lib import Config
+from sphinxcontrib.versioning.sphinx_ import RE_MARKER, marker, render_versions_list, TEMPLATES_DIR, versions_context
+
+STATE = dict()  # Per process: Versions, banner settings, Jinja2 environment and sidebar caches.
+
+
+def _init(versions, banner):
+    """Set up a process to run fill() in.
+
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param tuple banner: Banner main ref name (None if the banner isn't shown), greatest tag and recent tag settings.
+    """
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES_DIR))
+    environment.globals['_'] = lambda message: message
+    STATE.update(banner=banner, caches=dict(), environment=environment, versions=versions)
+
+
+def render(template, context):
+    """Render one of this extension's templates like Sphinx would.
+
+    :param str template: Template file name.
+    :param dict context: Jinja2 context.
+
+    :return: Rendered HTML.
+    :rtype: str
+    """
+    return STATE['environment'].get_template(template).render(context)
+
+
+def fill(path):
+    """Replace the contents of all markers in an HTML file with a freshly rendered banner or versions sidebar.
+
+    Markers are kept around the new contents so the file can be filled again when versions change. Markers of
+    versions that don't exist anymore are left alone.
+
+    :param str path: HTML file path.
+
+    :return: If the file changed.
+    :rtype: bool
+    """
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    if b'<!--scv-' not in data:
+        return False
+    text = data.decode('utf-8')
+    versions = STATE['versions']
+
+    def replace(match):
+        """Render the HTML of one marker.
+
+        :param match: RE_MARKER match.
+
+        :return: New marker.
+        :rtype: str
+        """
+        kind, values = match.group(1), json.loads(match.group(2))
+        if values['version'] not in [r['name'] for r in versions.remotes]:
+            return match.group(0)
+        context = versions_context(versions, values['version'], values['root'], *STATE['banner'])
+        context.update(html_theme=values['theme'], pagename=values['pagename'], project=values['project'])
+        versions.context = context
+        if kind == 'versions':
+            cache = STATE['caches'].setdefault((values['version'], values['root'], values['theme']), dict())
+            html = render_versions_list(render, versions, context, cache)
+        else:
+            html = render('banner.html', context) if STATE['banner'][0] else ''
+        return marker(kind, values, html)
+
+    filled = RE_MARKER.sub(replace, text)
+    if filled == text:
+        return False
+    with open(path, 'wb') as handle:
+        handle.write(filled.encode('utf-8'))
+    return True
+
+
+def fill_all(destination, versions, jobs):
+    """Fill markers in every HTML file in destination, running up to `jobs` processes at the same time.
+
+    :param str destination: Directory holding all built versions.
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param int jobs: Maximum number of concurrent processes.
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+    banner = (config.banner_main_ref if config.show_banner else None, config.banner_greatest_tag,
+              config.banner_recent_tag)
+    paths = [os.path.join(r, f) for r, _, fs in os.walk(destination) for f in fs if f.endswith('.html')]
+
+    if jobs > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(jobs, _init, (versions, banner))
+        try:
+            changed = sum(pool.imap_unordered(fill, paths, chunksize=64))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init(versions, banner)
+        changed = sum(fill(p) for p in paths)
+    log.info('Filled in versions sidebars and banners: %d of %d HTML files changed.', changed, len(paths))
+
+
+def write_versions_json(destination, versions):
+    """Write versions.json in destination. _static_json/versions.js reads it to render sidebars and banners.
+
+    :param str destination: Directory holding all built versions.
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+    data = dict(
+        banner_main_ref=config.banner_main_ref if config.show_banner else None,
+        docs=sorted(versions.docs, key=versions.docs.get),  # Bit order of found_docs.
+        pdf_file=versions.pdf_file,
+        versions=[dict(
+            found_docs='{0:x}'.format(r['found_docs']),
+            kind=r['kind'],
+            master_doc=r['master_doc'],
+            name=r['name'],
+            root_dir=r['root_dir'],
+        ) for r in versions.remotes],
+    )
+    path = os.path.join(destination, 'versions.json')
+    with open(path, 'w') as handle:
+        json.dump(data, handle, separators=(',', ':'), sort_keys=True)
+    log.info('Wrote %s with %d versions.', path, len(versions))
@@ -22,29 +22,51 @@ class Config(object):
         # Booleans.
         self.banner_greatest_tag = False
         self.banner_recent_tag = False
+        self.blob_store = False
+        self.explain_cache = False
         self.greatest_tag = False
+        self.incremental = False
         self.invert = False
+        self.limit_export = False
         self.no_colors = False
         self.no_local_conf = False
+        self.offline = False
         self.recent_tag = False
         self.show_banner = False
+        self.sync = False
+        self.targeted_fetch = False
+        self.worker_pool = False
 
         # Strings.
         self.banner_main_ref = 'master'
+        self.cache_dir = None
+        self.changes_file = None
         self.chdir = None
         self.git_root = None
+        self.keep_tags_since = None
         self.local_conf = None
         self.priority = None
         self.root_ref = 'master'
+        self.sidebar_mode = 'inline'
 
         # Tuples.
+        self.blacklist_branches = tuple()
+        self.blacklist_tags = tuple()
+        self.export_paths = tuple()
         self.overflow = tuple()
+        self.preload = tuple()
         self.sort = tuple()
         self.whitelist_branches = tuple()
         self.whitelist_tags = tuple()
 
         # Integers.
+        self.cache_size = 1024  # Megabytes.
+        self.generations = 0
+        self.jobs = 1
+        self.keep_branches = 0
+        self.keep_patches = 0
         self.verbose = 0
+        self.worker_builds = 20
 
         # Custom.
         self.pdf_file = None # Name of the pdf
@@ -168,3 +190,17 @@ class TempDir(object):
         shutil.rmtree(self.name, onerror=lambda *a: os.chmod(a[1], __import__('stat').S_IWRITE) or os.unlink(a[1]))
         if os.path.exists(self.name):
             raise IOError(17, "File exists: '{}'".format(self.name))
+
+
+def copy_tree(source, destination):
+    """Recursively copy all files in source into destination. Overwrites existing files but doesn't delete any.
+
+    :param str source: Directory to copy from.
+    :param str destination: Directory to copy into. Created if missing.
+    """
+    for root, _, files in os.walk(source):
+        target = os.path.join(destination, os.path.relpath(root, source))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in files:
+            shutil.copy2(os.path.join(root, name), os.path.join(target, name))
@@ -0,0 +1,246 @@
+"""Move built HTML from a local staging directory into DESTINATION."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from sphinxcontrib.versioning.lib import Config, HandledError
+
+CURRENT = 'current'
+GENERATIONS = 'generations'
+MANIFEST = '.scv_manifest.json'
+
+
+def hash_tree(path):
+    """Hash the contents of every file in a directory.
+
+    :param str path: Directory to walk.
+
+    :return: Hex digests by file path relative to path, using forward slashes.
+    :rtype: dict
+    """
+    hashes = dict()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest = hashlib.sha1()
+            with open(file_path, 'rb') as handle:
+                for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            hashes[os.path.relpath(file_path, path).replace(os.sep, '/')] = digest.hexdigest()
+    return hashes
+
+
+def manifest_path(directory):
+    """Get the manifest file path of a published directory. It's next to the directory so it isn't published with it.
+
+    :param str directory: Directory the manifest lists files of (e.g. DESTINATION).
+
+    :return: File path, e.g. "html.scv_manifest.json" for "html".
+    :rtype: str
+    """
+    return os.path.abspath(directory).rstrip(os.sep) + MANIFEST
+
+
+def read_manifest(directory):
+    """Read the manifest written by sync() or swap() for a directory.
+
+    Older versions kept the manifest inside the directory, it's still read from there if there's none next to it.
+
+    :param str directory: Directory the manifest lists files of.
+
+    :return: Hex digests by relative file path. Empty if the manifest is missing or unreadable.
+    :rtype: dict
+    """
+    for path in (manifest_path(directory), os.path.join(directory, MANIFEST)):
+        try:
+            with open(path) as handle:
+                return dict(json.load(handle)['files'])
+        except (IOError, OSError, KeyError, TypeError, ValueError):
+            continue
+    return dict()
+
+
+def write_json(path, data):
+    """Atomically write JSON to a file.
+
+    :param str path: File path.
+    :param dict data: JSON serializable data.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as handle:
+        json.dump(data, handle, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def diff(previous, current):
+    """Compare two manifests.
+
+    :param dict previous: Hex digests by relative file path of the old files.
+    :param dict current: Hex digests by relative file path of the new files.
+
+    :return: Relative file paths by change: added, updated, deleted.
+    :rtype: dict
+    """
+    return dict(
+        added=sorted(p for p in current if p not in previous),
+        updated=sorted(p for p in current if p in previous and previous[p] != current[p]),
+        deleted=sorted(p for p in previous if p not in current),
+    )
+
+
+def prune(staging, keep):
+    """Delete directories at the top of staging that aren't in keep, e.g. the output of a deleted branch.
+
+    :param str staging: Directory holding a build kept between runs.
+    :param iter keep: Directory names still written by the build.
+
+    :return: Deleted directory names.
+    :rtype: list
+    """
+    log = logging.getLogger(__name__)
+    keep = set(keep)
+    deleted = sorted(n for n in os.listdir(staging) if n not in keep and os.path.isdir(os.path.join(staging, n)))
+    for name in deleted:
+        log.info('Removing output of a version that is gone: %s', name)
+        shutil.rmtree(os.path.join(staging, name))
+    return deleted
+
+
+def sync(staging, destination, changes_file=None):
+    """Copy/update/delete only changed files in destination so it mirrors staging.
+
+    The manifest of the previous sync (hashes of every file written into destination) is kept next to destination, see
+    manifest_path(). Files not in it are never deleted. Changed files are written to a temporary file first then renamed over the old one so
+    readers never see half written files.
+
+    :param str staging: Directory holding the new build.
+    :param str destination: Directory to update.
+    :param str changes_file: Write added, updated and deleted relative file paths to this JSON file.
+
+    :return: Relative file paths by change: added, updated, deleted.
+    :rtype: dict
+    """
+    log = logging.getLogger(__name__)
+    previous = read_manifest(destination)
+    current = hash_tree(staging)
+    current.pop(MANIFEST, None)
+    changes = diff(previous, current)
+
+    for rel_path in changes['added'] + changes['updated']:
+        source, target = os.path.join(staging, rel_path), os.path.join(destination, rel_path)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy2(source, target + '.scv_tmp')
+        os.replace(target + '.scv_tmp', target)
+    for rel_path in changes['deleted']:
+        target = os.path.join(destination, rel_path)
+        try:
+            os.remove(target)
+        except OSError:
+            continue
+        # Remove directories left empty.
+        parent = os.path.dirname(target)
+        while os.path.abspath(parent) != os.path.abspath(destination) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+
+    write_json(manifest_path(destination), dict(files=current))
+    if os.path.isfile(os.path.join(destination, MANIFEST)):
+        os.remove(os.path.join(destination, MANIFEST))  # Written by older versions.
+    if changes_file:
+        write_json(changes_file, changes)
+    log.info('Synced %s: %d added, %d updated, %d deleted, %d unchanged.', destination, len(changes['added']),
+             len(changes['updated']), len(changes['deleted']),
+             len(current) - len(changes['added']) - len(changes['updated']))
+    return changes
+
+
+def swap(staging, destination, keep, changes_file=None):
+    """Publish staging as a new generation directory in destination and atomically point destination/current to it.
+
+    Files that didn't change since the previous generation are hardlinked instead of copied. Readers going through the
+    current symlink see either the old or the new generation, never a mix. Generations beyond the newest keep ones are
+    deleted afterwards.
+
+    :raise HandledError: If destination/current exists but isn't a symlink. Will be logged before raising.
+
+    :param str staging: Directory holding the new build.
+    :param str destination: Directory holding generations and the current symlink.
+    :param int keep: Number of generations to keep, including the new one.
+    :param str changes_file: Write added, updated and deleted relative file paths (since the previous generation) to
+        this JSON file.
+
+    :return: Relative file paths by change: added, updated, deleted.
+    :rtype: dict
+    """
+    log = logging.getLogger(__name__)
+    link = os.path.join(destination, CURRENT)
+    if os.path.lexists(link) and not os.path.islink(link):
+        log.error('%s exists and is not a symlink.', link)
+        raise HandledError
+    generations_dir = os.path.join(destination, GENERATIONS)
+    if not os.path.isdir(generations_dir):
+        os.makedirs(generations_dir)
+    numbers = sorted(int(n) for n in os.listdir(generations_dir) if n.isdigit())
+
+    # Assemble the new generation next to the previous one.
+    previous_dir = os.path.join(generations_dir, '{0:06d}'.format(numbers[-1])) if numbers else None
+    previous = read_manifest(previous_dir) if previous_dir else dict()
+    name = '{0:06d}'.format(numbers[-1] + 1 if numbers else 1)
+    target_dir = os.path.join(generations_dir, name)
+    current = hash_tree(staging)
+    current.pop(MANIFEST, None)
+    linked = 0
+    for rel_path, digest in current.items():
+        target = os.path.join(target_dir, rel_path)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        if previous.get(rel_path) == digest:
+            try:
+                os.link(os.path.join(previous_dir, rel_path), target)
+                linked += 1
+                continue
+            except OSError:
+                pass
+        shutil.copy2(os.path.join(staging, rel_path), target)
+    write_json(manifest_path(target_dir), dict(files=current))
+
+    # Swap.
+    temp_link = link + '.tmp'
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(os.path.join(GENERATIONS, name), temp_link)
+    os.replace(temp_link, link)
+    log.info('Published generation %s: %d files copied, %d hardlinked.', name, len(current) - linked, linked)
+
+    # Garbage collect.
+    for number in (numbers + [int(name)])[:-keep]:
+        log.debug('Removing old generation %06d.', number)
+        old_dir = os.path.join(generations_dir, '{0:06d}'.format(number))
+        shutil.rmtree(old_dir, True)
+        if os.path.isfile(manifest_path(old_dir)):
+            os.remove(manifest_path(old_dir))
+
+    changes = diff(previous, current)
+    if changes_file:
+        write_json(changes_file, changes)
+    return changes
+
+
+def publish(staging, destination):
+    """Move a build from staging into destination with either swap() or sync() depending on the config.
+
+    :param str staging: Directory holding the new build.
+    :param str destination: Destination directory.
+
+    :return: Relative file paths by change: added, updated, deleted.
+    :rtype: dict
+    """
+    config = Config.from_context()
+    if config.generations:
+        return swap(staging, destination, config.generations, config.changes_file)
+    return sync(staging, destination, config.changes_file)
@@ -1,14 +1,24 @@
 """Functions that perform main tasks. Code is here instead of in __main__.py."""
 
+import calendar
+import datetime
+import functools
+import hashlib
 import json
 import logging
 import os
 import re
+import shutil
 import subprocess
 
-from sphinxcontrib.versioning.git import export, fetch_commits, filter_and_date, GitError, list_remote
-from sphinxcontrib.versioning.lib import Config, HandledError, TempDir
-from sphinxcontrib.versioning.sphinx_ import build, read_config
+from sphinxcontrib.versioning.cache import BuildCache, CommitCache, tree_hashes
+from sphinxcontrib.versioning.git import (
+    batch_check, export, export_linked, fetch_commits, filter_and_date, GitError, list_local, list_remote,
+)
+from sphinxcontrib.versioning.inject import fill_all, write_versions_json
+from sphinxcontrib.versioning.lib import Config, copy_tree, HandledError, TempDir
+from sphinxcontrib.versioning.sphinx_ import build_many, read_config, read_configs, WorkerPool
+from sphinxcontrib.versioning.versions import is_prerelease, semver_key, semvers
 
 RE_INVALID_FILENAME = re.compile(r'[^0-9A-Za-z.-]')
 
@@ -26,16 +36,134 @@ def read_local_conf(local_conf):
     # Attempt to read.
     log.info('Reading config from %s...', local_conf)
     try:
-        config = read_config(os.path.dirname(local_conf), '<local>')
+        # Outside of the worker pool: it isn't configured yet and should preload the extensions used here.
+        config = read_config(os.path.dirname(local_conf), '<local>', worker_pool=False)
     except HandledError:
         log.warning('Unable to read file, continuing with only CLI args.')
         return dict()
 
+    # Preloaded by the worker pool together with the extensions of all versions, see pre_build().
+    Config.from_context()['local_modules'] = config['extensions'] + (config['html_theme'],)
+
     # Filter and return.
     return {k[4:]: v for k, v in config.items() if k.startswith('scv_') and not k[4:].startswith('_')}
 
 
-def gather_git_info(root, conf_rel_paths, whitelist_branches, whitelist_tags):
+def ref_dir_name(remote):
+    """Stable and unique directory name for a ref, for directories kept between runs.
+
+    :param dict remote: Version from Versions.remotes.
+
+    :return: Directory name derived from the ref's kind and name.
+    :rtype: str
+    """
+    digest = hashlib.sha1(remote['id'].encode('utf-8')).hexdigest()[:8]
+    return '{0}-{1}'.format(RE_INVALID_FILENAME.sub('_', remote['id']), digest)
+
+
+def export_dir(exported_root, remote):
+    """Get the directory holding a remote's exported files.
+
+    Normally there is one directory per commit SHA. With the incremental setting there is one directory per ref that
+    keeps the same path between runs, as Sphinx discards its saved environment when the source directory moves.
+
+    :param str exported_root: Path with exported commits as subdirectories.
+    :param dict remote: Version from Versions.remotes.
+
+    :return: Directory path, the git root of the exported commit.
+    :rtype: str
+    """
+    if Config.from_context().incremental:
+        return os.path.join(exported_root, ref_dir_name(remote))
+    return os.path.join(exported_root, remote['sha'])
+
+
+def export_paths(local_root, remote):
+    """Get the paths to export for a remote when the limit_export setting is enabled.
+
+    That's REL_SOURCE (the directory holding conf.py) and every export_paths entry that exists in the commit.
+
+    :param str local_root: Local path to git root directory.
+    :param dict remote: Version from Versions.remotes.
+
+    :return: Paths relative to the git root, or None to export everything.
+    :rtype: list
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+    rel_source = os.path.dirname(remote['conf_rel_path']).replace(os.sep, '/')
+    if not config.limit_export or not rel_source:
+        return None
+    extra = [p.replace(os.sep, '/').strip('/') for p in config.export_paths]
+    extra = [p for p in extra if p and p != rel_source]
+    paths = [rel_source]
+    for path, found in zip(extra, batch_check(local_root, ['{0}:{1}'.format(remote['sha'], p) for p in extra])):
+        if found:
+            paths.append(path)
+        else:
+            log.debug('Export path %s does not exist in %s.', path, remote['sha'])
+    return paths
+
+
+@functools.lru_cache(maxsize=None)
+def staged_doctrees_root():
+    """Temporary directory for Sphinx doctree/environment directories of builds staged by the sync and generations
+    settings. Same directory for the whole process so the watch sub command reuses it.
+
+    :return: Directory path.
+    :rtype: str
+    """
+    return TempDir(True).name
+
+
+def doctree_dir(remote, is_root):
+    """Get the Sphinx doctree/environment directory of a ref when it shouldn't be in the output directory.
+
+    With the incremental setting it's persistent. With the sync and generations settings it's temporary and outside of
+    the staging directory, doctree pickles differ between identical builds and would be published every time.
+
+    :param dict remote: Version from Versions.remotes.
+    :param bool is_root: Is this build in the web root? It gets its own directory.
+
+    :return: Directory path or None to use sphinx-build's default (.doctrees in the output directory).
+    :rtype: str
+    """
+    config = Config.from_context()
+    name = ref_dir_name(remote) + ('-root' if is_root else '')
+    if config.incremental:
+        return os.path.join(config.cache_dir, 'doctrees', name)
+    if config.sync or config.generations:
+        return os.path.join(staged_doctrees_root(), name)
+    return None
+
+
+def filter_refs(remotes, whitelist_branches, whitelist_tags, blacklist_branches=(), blacklist_tags=()):
+    """Keep branches/tags matching any whitelist pattern of their kind (if any) and no blacklist pattern.
+
+    :param iter remotes: Output of list_remote() or list_local().
+    :param iter whitelist_branches: Optional list of patterns to filter branches by.
+    :param iter whitelist_tags: Optional list of patterns to filter tags by.
+    :param iter blacklist_branches: Optional list of patterns to exclude branches by.
+    :param iter blacklist_tags: Optional list of patterns to exclude tags by.
+
+    :return: Remaining items of remotes.
+    :rtype: list
+    """
+    whitelists = dict(heads=[re.compile(p) for p in whitelist_branches], tags=[re.compile(p) for p in whitelist_tags])
+    blacklists = dict(heads=[re.compile(p) for p in blacklist_branches], tags=[re.compile(p) for p in blacklist_tags])
+    filtered = list()
+    for remote in remotes:
+        name, kind = remote[1], remote[2]
+        if whitelists[kind] and not any(p.search(name) for p in whitelists[kind]):
+            continue
+        if any(p.search(name) for p in blacklists[kind]):
+            continue
+        filtered.append(remote)
+    return filtered
+
+
+def gather_git_info(root, conf_rel_paths, whitelist_branches, whitelist_tags, blacklist_branches=(),
+                    blacklist_tags=(), skipped=()):
     """Gather info about the remote git repository. Get list of refs.
 
     :raise HandledError: If function fails with a handled error. Will be logged before raising.
@@ -44,92 +172,252 @@ def gather_git_info(root, conf_rel_paths, whitelist_branches, whitelist_tags):
     :param iter conf_rel_paths: List of possible relative paths (to git root) of Sphinx conf.py (e.g. docs/conf.py).
     :param iter whitelist_branches: Optional list of patterns to filter branches by.
     :param iter whitelist_tags: Optional list of patterns to filter tags by.
+    :param iter blacklist_branches: Optional list of patterns to exclude branches by.
+    :param iter blacklist_tags: Optional list of patterns to exclude tags by.
+    :param iter skipped: Optional (name, sha) tuples of commits to exclude before applying retention policies.
 
     :return: Commits with docs. A list of tuples: (sha, name, kind, date, conf_rel_path).
     :rtype: list
     """
     log = logging.getLogger(__name__)
+    config = Config.from_context()
 
     # List remote.
-    log.info('Getting list of all remote branches/tags...')
+    dates = dict()
     try:
-        remotes = list_remote(root)
+        if config.offline:
+            log.info('Getting list of all branches/tags from local refs...')
+            remotes = list_local(root)
+            dates = {i[0]: i[3] for i in remotes}
+            remotes = [i[:3] for i in remotes]
+        else:
+            log.info('Getting list of all remote branches/tags...')
+            remotes = list_remote(root)
     except GitError as exc:
         log.error(exc.message)
         log.error(exc.output)
         raise HandledError
     log.info('Found: %s', ' '.join(i[1] for i in remotes))
 
+    # Apply whitelist and blacklist before anything runs git on each ref.
+    if whitelist_branches or whitelist_tags or blacklist_branches or blacklist_tags:
+        remotes = filter_refs(remotes, whitelist_branches, whitelist_tags, blacklist_branches, blacklist_tags)
+        log.info('Passed whitelisting: %s', ' '.join(i[1] for i in remotes))
+
     # Filter and date.
+    if config.cache_dir:
+        commit_cache = CommitCache(os.path.join(config.cache_dir, 'commits.jsonl'), conf_rel_paths)
+        filter_and_date_ = functools.partial(commit_cache.filter_and_date, root)
+    else:
+        filter_and_date_ = functools.partial(filter_and_date, root, conf_rel_paths)
     try:
         try:
-            dates_paths = filter_and_date(root, conf_rel_paths, (i[0] for i in remotes))
+            dates_paths = filter_and_date_((i[0] for i in remotes), dates)
         except GitError:
+            if config.offline:
+                raise
             log.info('Need to fetch from remote...')
-            fetch_commits(root, remotes)
-            try:
-                dates_paths = filter_and_date(root, conf_rel_paths, (i[0] for i in remotes))
-            except GitError as exc:
-                log.error(exc.message)
-                log.error(exc.output)
-                raise HandledError
+            fetch_commits(root, remotes, fetch_all=not config.targeted_fetch)
+            dates_paths = filter_and_date_(i[0] for i in remotes)
+    except GitError as exc:
+        log.error(exc.message)
+        log.error(exc.output)
+        raise HandledError
     except subprocess.CalledProcessError as exc:
         log.error(json.dumps(dict(command=exc.cmd, cwd=root, code=exc.returncode, output=exc.output)))
         log.error('Failed to get dates for all remote commits.')
         raise HandledError
     filtered_remotes = [[i[0], i[1], i[2], ] + dates_paths[i[0]] for i in remotes if i[0] in dates_paths]
     log.info('With docs: %s', ' '.join(i[1] for i in filtered_remotes))
-    if not whitelist_branches and not whitelist_tags:
-        return filtered_remotes
-
-    # Apply whitelist.
-    whitelisted_remotes = list()
-    for remote in filtered_remotes:
-        if remote[2] == 'heads' and whitelist_branches:
-            if not any(re.search(p, remote[1]) for p in whitelist_branches):
-                continue
-        if remote[2] == 'tags' and whitelist_tags:
-            if not any(re.search(p, remote[1]) for p in whitelist_tags):
-                continue
-        whitelisted_remotes.append(remote)
-    log.info('Passed whitelisting: %s', ' '.join(i[1] for i in whitelisted_remotes))
+    if skipped:
+        skipped = set(skipped)
+        filtered_remotes = [i for i in filtered_remotes if (i[1], i[0]) not in skipped]
+
+    # Apply retention policies.
+    if config.keep_branches or config.keep_patches or config.keep_tags_since:
+        filtered_remotes = retain(filtered_remotes)
+        log.info('Retained: %s', ' '.join(i[1] for i in filtered_remotes))
 
-    return whitelisted_remotes
+    return filtered_remotes
 
 
-def pre_build(local_root, versions):
-    """Build docs for all versions to determine root directory and master_doc names.
+def retain(remotes):
+    """Drop old branches/tags according to the keep_branches, keep_patches and keep_tags_since settings.
 
-    Need to build docs to (a) avoid filename collision with files from root_ref and branch/tag names and (b) determine
-    master_doc config values for all versions (in case master_doc changes from e.g. contents.rst to index.rst between
-    versions).
+    The root ref and banner main ref are always kept, including the tags the greatest_tag and recent_tag settings (and
+    their banner counterparts) will pick from all tags. Tags that aren't valid versions aren't subject to keep_patches,
+    pre-releases are counted separately from releases of the same minor version.
+
+    :raise HandledError: If keep_tags_since isn't a valid date. Will be logged before raising.
+
+    :param iter remotes: Output of gather_git_info(): lists of sha, name, kind, date, conf_rel_path.
+
+    :return: Remaining items of remotes, order preserved.
+    :rtype: list
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+    remotes = list(remotes)
+    dropped = set()
+
+    # Root and banner main refs, resolved like get_versions() will before anything is dropped. Keeps ties too.
+    tags = [r for r in remotes if r[2] == 'tags']
+    protected = set()
+    for ref, greatest_tag, recent_tag in (
+            (config.root_ref, config.greatest_tag, config.recent_tag),
+            (config.banner_main_ref, config.show_banner and config.banner_greatest_tag,
+             config.show_banner and config.banner_recent_tag)):
+        if tags and greatest_tag:
+            greatest = min(semver_key(r[1]) for r in tags)
+            protected.update(r[1] for r in tags if semver_key(r[1]) == greatest)
+        elif tags and recent_tag:
+            recent = max(r[3] for r in tags)
+            protected.update(r[1] for r in tags if r[3] == recent)
+        else:
+            protected.add(ref)
+
+    # Latest K branches by commit time.
+    if config.keep_branches:
+        branches = sorted((r for r in remotes if r[2] == 'heads'), key=lambda r: -r[3])
+        dropped.update(id(r) for r in branches[config.keep_branches:])
+
+    # Tags committed since a date.
+    if config.keep_tags_since:
+        try:
+            since = datetime.datetime.strptime(config.keep_tags_since, '%Y-%m-%d')
+        except ValueError:
+            log.error('Invalid date %s, must be YYYY-MM-DD.', config.keep_tags_since)
+            raise HandledError
+        since = calendar.timegm(since.timetuple())
+        dropped.update(id(r) for r in remotes if r[2] == 'tags' and r[3] < since)
+
+    # Latest N patch releases of each major.minor version, and latest N pre-releases.
+    if config.keep_patches:
+        per_minor = dict()
+        for key, remote in sorted(zip(semvers(r[1] for r in tags), tags), key=lambda i: i[0]):
+            if key[0] == 0:  # Valid version.
+                per_minor.setdefault(key[1:3] + (is_prerelease(remote[1]),), list()).append(remote)
+        for releases in per_minor.values():
+            dropped.update(id(r) for r in releases[config.keep_patches:])
+
+    return [r for r in remotes if id(r) not in dropped or r[1] in protected]
+
+
+def prune_incremental(cache_dir, versions):
+    """Delete exported sources and doctree directories of refs that aren't built anymore (deleted, filtered out or
+    dropped by retention policies) from the cache directory.
+
+    :param str cache_dir: Cache directory of the incremental setting.
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    """
+    log = logging.getLogger(__name__)
+    names = {ref_dir_name(r) for r in versions.remotes}
+    keep = dict(sources=names | {n + '.sha' for n in names}, doctrees=names | {n + '-root' for n in names})
+    for subdir, kept in keep.items():
+        path = os.path.join(cache_dir, subdir)
+        for name in sorted(set(os.listdir(path)) - kept) if os.path.isdir(path) else ():
+            log.debug('Removing %s of a ref that is gone: %s', subdir, name)
+            if os.path.isdir(os.path.join(path, name)):
+                shutil.rmtree(os.path.join(path, name))
+            else:
+                os.remove(os.path.join(path, name))
+
+
+def pre_build(local_root, versions, exported_root=None, configs=None):
+    """Partially run Sphinx for all versions to determine root directory and master_doc names.
+
+    Need to read docs to (a) avoid filename collision with files written by root_ref and branch/tag names and (b)
+    determine master_doc config values for all versions (in case master_doc changes from e.g. contents.rst to index.rst
+    between versions).
 
     Exports all commits into a temporary directory and returns the path to avoid re-exporting during the final build.
+    With the incremental setting refs are exported into the cache directory instead and only re-exported when their SHA
+    changed.
+
+    :raise HandledError: If reading the root ref fails. Will be logged before raising.
 
     :param str local_root: Local path to git root directory.
     :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param str exported_root: Temporary directory of a previous call. Commits already exported there are kept.
+    :param dict configs: Sphinx configs of a previous call by SHA and conf.py path. Only other versions are read, then
+        added to it.
 
     :return: Tempdir path with exported commits as subdirectories.
     :rtype: str
     """
     log = logging.getLogger(__name__)
-    exported_root = TempDir(True).name
+    config = Config.from_context()
+    extract = export
+    if config.blob_store:
+        store = os.path.join(config.cache_dir, 'blobs') if config.cache_dir else TempDir(True).name
+        extract = functools.partial(export_linked, store=store)
 
     # Extract all.
-    for sha in {r['sha'] for r in versions.remotes}:
-        target = os.path.join(exported_root, sha)
-        log.debug('Exporting %s to temporary directory.', sha)
-        export(local_root, sha, target)
-
-    # Build root.
-    remote = versions[Config.from_context().root_ref]
-    with TempDir() as temp_dir:
-        log.debug('Building root (before setting root_dirs) in temporary directory: %s', temp_dir)
-        source = os.path.dirname(os.path.join(exported_root, remote['sha'], remote['conf_rel_path']))
-        build(source, temp_dir, versions, remote['name'], True)
-        existing = os.listdir(temp_dir)
-
-    # Define root_dir for all versions to avoid file name collisions.
+    if config.incremental:
+        prune_incremental(config.cache_dir, versions)
+        exported_root = os.path.join(config.cache_dir, 'sources')
+        for remote in versions.remotes:
+            target = export_dir(exported_root, remote)
+            paths = export_paths(local_root, remote)
+            marker = '\n'.join([remote['sha']] + (paths or []))
+            try:
+                with open(target + '.sha') as handle:
+                    if handle.read().strip() == marker:
+                        log.debug('Already exported %s to %s.', remote['sha'], target)
+                        continue
+            except IOError:
+                pass
+            log.debug('Exporting %s to %s.', remote['sha'], target)
+            if os.path.exists(target + '.sha'):
+                os.remove(target + '.sha')
+            shutil.rmtree(target, True)
+            extract(local_root, remote['sha'], target, paths=paths)
+            with open(target + '.sha', 'w') as handle:
+                handle.write(marker)
+    else:
+        exported_root = exported_root or TempDir(True).name
+        for remote in {r['sha']: r for r in versions.remotes}.values():
+            target = os.path.join(exported_root, remote['sha'])
+            if os.path.isdir(target):
+                log.debug('Already exported %s to temporary directory.', remote['sha'])
+                continue
+            log.debug('Exporting %s to temporary directory.', remote['sha'])
+            extract(local_root, remote['sha'], target, paths=export_paths(local_root, remote))
+
+    # Get found_docs, master_doc and output file names for all versions.
+    root_remote = versions[config.root_ref]
+    configs = dict() if configs is None else configs
+    unread, sources = list(), list()
+    for remote in versions.remotes:
+        if (remote['sha'], remote['conf_rel_path']) in configs:
+            continue
+        log.debug('Partially running sphinx-build to read configuration for: %s', remote['name'])
+        source = os.path.dirname(os.path.join(export_dir(exported_root, remote), remote['conf_rel_path']))
+        sources.append((source, remote['name'], doctree_dir(remote, False)))
+        unread.append((remote['sha'], remote['conf_rel_path']))
+    # Outside of the worker pool until it started: it should preload the extensions and themes found here.
+    configs.update(zip(unread, read_configs(sources, config.jobs, worker_pool=WorkerPool.INSTANCE is not None)))
+    if config.worker_pool and WorkerPool.INSTANCE is None:
+        modules = list(config.pop('local_modules', ()))
+        for sphinx_config in (c for c in configs.values() if c):
+            modules.extend(sphinx_config['extensions'] + (sphinx_config['html_theme'],))
+        WorkerPool.get(config, modules)  # Worker processes import Sphinx while root directories are picked.
+    existing = None
+    for remote in list(versions.remotes):
+        sphinx_config = configs[(remote['sha'], remote['conf_rel_path'])]
+        if sphinx_config is None and remote is root_remote:
+            raise HandledError
+        if sphinx_config is None:
+            log.warning('Skipping. Will not be building: %s', remote['name'])
+            versions.remotes.pop(versions.remotes.index(remote))
+            continue
+        versions.set_found_docs(remote, sphinx_config['found_docs'])
+        remote['master_doc'] = sphinx_config['master_doc']
+        if remote is root_remote:
+            existing = list(sphinx_config['output_names'])
+
+    # Define root_dir for all versions to avoid file name collisions with the root ref's output.
+    log.debug('Root ref %s writes: %s', root_remote['name'], ' '.join(existing))
     for remote in versions.remotes:
         root_dir = RE_INVALID_FILENAME.sub('_', remote['name'])
         while root_dir in existing:
@@ -138,48 +426,91 @@ def pre_build(local_root, versions):
         log.debug('%s root directory is %s', remote['name'], root_dir)
         existing.append(root_dir)
 
-    # Get found_docs and master_doc values for all versions.
-    for remote in list(versions.remotes):
-        log.debug('Partially running sphinx-build to read configuration for: %s', remote['name'])
-        source = os.path.dirname(os.path.join(exported_root, remote['sha'], remote['conf_rel_path']))
-        try:
-            config = read_config(source, remote['name'])
-        except HandledError:
-            log.warning('Skipping. Will not be building: %s', remote['name'])
-            versions.remotes.pop(versions.remotes.index(remote))
-            continue
-        remote['found_docs'] = config['found_docs']
-        remote['master_doc'] = config['master_doc']
-
     return exported_root
 
 
-def build_all(exported_root, destination, versions):
-    """Build all versions.
+def build_all(exported_root, destination, versions, only=None):
+    """Build all versions, or only some of them if the others are already in destination.
+
+    The root ref and all other refs are built concurrently when the jobs setting is greater than 1. Their outputs never
+    overlap since pre_build() picked root_dir names that don't collide with files from the root ref.
+
+    If the cache_dir setting is set builds are looked up in the persistent build cache first and copied from there
+    instead of running sphinx-build. New builds are staged in the cache, stored, then copied into destination.
+
+    With the inject and json sidebar modes builds don't depend on other versions, so a failed version doesn't cause
+    other versions to be rebuilt. Versions sidebars and banners of all HTML files in destination are filled in
+    afterwards (inject) or versions.json is written for the browser to render them (json).
+
+    :raise HandledError: If the root ref fails to build. Will be logged before raising.
 
     :param str exported_root: Tempdir path with exported commits as subdirectories.
     :param str destination: Destination directory to copy/overwrite built docs to. Does not delete old files.
     :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param iter only: Only build versions with these ids (e.g. heads/master). All versions are built if one fails.
     """
     log = logging.getLogger(__name__)
+    config = Config.from_context()
+    only = None if only is None else set(only)
+    cache, trees = None, dict()
+    if config.cache_dir:
+        cache = BuildCache(os.path.join(config.cache_dir, 'builds'), config.cache_size * 1024 * 1024)
+        trees = tree_hashes(config.git_root, versions.remotes, config.export_paths)
 
-    while True:
-        # Build root.
-        remote = versions[Config.from_context().root_ref]
-        log.info('Building root: %s', remote['name'])
-        source = os.path.dirname(os.path.join(exported_root, remote['sha'], remote['conf_rel_path']))
-        build(source, destination, versions, remote['name'], True)
-
-        # Build all refs.
-        for remote in list(versions.remotes):
-            log.info('Building ref: %s', remote['name'])
-            source = os.path.dirname(os.path.join(exported_root, remote['sha'], remote['conf_rel_path']))
-            target = os.path.join(destination, remote['root_dir'])
-            try:
-                build(source, target, versions, remote['name'], False)
-            except HandledError:
-                log.warning('Skipping. Will not be building %s. Rebuilding everything.', remote['name'])
+    try:
+        while True:
+            # Queue root first, then all refs.
+            queue = [(versions[config.root_ref], destination, True)]
+            queue.extend((r, os.path.join(destination, r['root_dir']), False) for r in versions.remotes)
+            if only is not None:
+                queue = [q for q in queue if q[0]['id'] in only]
+
+            # Reuse cached builds and stage the others in the cache.
+            builds, built_remotes, staged = list(), list(), dict()
+            for remote, target, is_root in queue:
+                source = os.path.dirname(os.path.join(export_dir(exported_root, remote), remote['conf_rel_path']))
+                if cache:
+                    name = remote['id'] + (' (root)' if is_root else '')
+                    components = cache.components(remote, is_root, versions, config, trees.get(remote['id']))
+                    reason = cache.explain(name, components)
+                    if config.explain_cache:
+                        log.info('Cache: %s %s.', name, 'reused' if reason is None else 'rebuilding, ' + reason)
+                    if reason is None:
+                        log.info('Copying cached build of %s: %s', 'root' if is_root else 'ref', remote['name'])
+                        cache.restore(cache.key(components), target)
+                        continue
+                    staged[len(builds)] = name, components, target
+                    target = cache.staging()
+                builds.append((source, target, remote['name'], is_root, doctree_dir(remote, is_root)))
+                built_remotes.append(remote)
+
+            # Build.
+            # Without concurrency stop at the first failure if it means rebuilding everything anyway.
+            stop = config.jobs <= 1 and config.sidebar_mode == 'inline'
+            failed, not_run = build_many(builds, versions, config.jobs, stop_on_failure=stop)
+            for i, (name, components, target) in staged.items():
+                if builds[i] in failed or builds[i] in not_run:
+                    shutil.rmtree(builds[i][1], True)
+                else:
+                    copy_tree(cache.store(name, components, builds[i][1]), target)
+            if any(b[3] for b in failed):
+                raise HandledError
+            if not failed:
+                break
+            for remote in (built_remotes[builds.index(b)] for b in failed):
+                if config.sidebar_mode == 'inline':
+                    log.warning('Skipping. Will not be building %s. Rebuilding everything.', remote['name'])
+                else:
+                    log.warning('Skipping. Will not be building %s.', remote['name'])
                 versions.remotes.pop(versions.remotes.index(remote))
-                break  # Break out of for loop.
-        else:
-            break  # Break out of while loop if for loop didn't execute break statement above.
+            if config.sidebar_mode != 'inline':
+                break  # Sidebars are filled in below.
+            only = None
+    finally:
+        if cache:
+            cache.save()
+
+    if config.sidebar_mode == 'inject':
+        fill_all(destination, versions, config.jobs)
+    elif config.sidebar_mode == 'json':
+        write_versions_json(destination, versions)
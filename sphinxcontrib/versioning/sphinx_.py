@@ -1,38 +1,200 @@
 """Interface with Sphinx."""
 
+import atexit
 import datetime
+import functools
+import html
+import json
 import logging
 import multiprocessing
 import os
+import queue
+import re
+import signal
 import sys
+import traceback
+from multiprocessing import forkserver
+from multiprocessing.connection import wait
 from shutil import copyfile, rmtree
+from subprocess import CalledProcessError
 
 from sphinx import application, locale
 from sphinx.cmd.build import build_main, make_main
 from sphinx.builders.html import StandaloneHTMLBuilder
 from sphinx.config import Config as SphinxConfig
+from sphinx.environment.adapters.indexentries import IndexEntries
 from sphinx.errors import SphinxError
 from sphinx.jinja2glue import SphinxFileSystemLoader
 from sphinx.util.i18n import format_date
 
 from sphinxcontrib.versioning import __version__
+from sphinxcontrib.versioning.git import run_command
 from sphinxcontrib.versioning.lib import Config, HandledError, TempDir
+from sphinxcontrib.versioning.setup_logging import setup_logging
 from sphinxcontrib.versioning.versions import Versions
 
+PAGENAME_PLACEHOLDER = '\x00scv_pagename\x00'
+RE_MARKER = re.compile(r'<!--scv-(banner|versions) (\{.*?\})-->.*?<!--/scv-\1-->', re.DOTALL)
 SC_VERSIONING_VERSIONS = list()  # Updated after forking.
 STATIC_DIR = os.path.join(os.path.dirname(__file__), '_static')
+STATIC_JSON_DIR = os.path.join(os.path.dirname(__file__), '_static_json')  # Only for the json sidebar mode.
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '_templates')
+
+
+def marker(kind, values, html=''):
+    """Wrap HTML in comments that inject.fill() finds and replaces, see RE_MARKER.
+
+    :param str kind: What the HTML is: banner or versions.
+    :param dict values: JSON serializable values needed to render the HTML later.
+    :param str html: Current HTML.
+
+    :return: HTML.
+    :rtype: str
+    """
+    data = json.dumps(values, sort_keys=True).replace('-', '\\u002d')  # HTML comments can't contain "--".
+    return '<!--scv-{0} {1}-->{2}<!--/scv-{0}-->'.format(kind, data, html)
+
+
+def _output_names(app, env):
+    """Predict the names of files and directories the HTML builder will write to the top of its output directory.
+
+    Errs on the side of listing too many names, e.g. viewcode's _modules even if no module source is shown.
+
+    :param sphinx.application.Sphinx app: Sphinx application object.
+    :param sphinx.environment.BuildEnvironment env: Sphinx build environment after reading all documents.
+
+    :return: File and directory names.
+    :rtype: set
+    """
+    config = app.config
+    names = {'.buildinfo', '.doctrees', '_static', 'objects.inv', 'search.html', 'searchindex.js'}
+    suffix = config.html_file_suffix or '.html'
+
+    # Pages.
+    names.update(app.builder.get_target_uri(d).split('/')[0] for d in env.found_docs)
+    names.update((p + suffix).split('/')[0] for p in config.html_additional_pages)
+    if config.html_copy_source:
+        names.add('_sources')
+    if env.images:
+        names.add('_images')
+    if env.dlfiles:
+        names.add('_downloads')
+    if 'sphinx.ext.viewcode' in config.extensions:
+        names.add('_modules')
+
+    # Indices.
+    if config.html_use_index:
+        names.add('genindex' + suffix)
+        if config.html_split_index:
+            names.add('genindex-all' + suffix)
+            names.update('genindex-{0}{1}'.format(k, suffix) for k, _ in IndexEntries(env).create_index(app.builder))
+    if config.html_domain_indices:
+        for domain in env.domains.values():
+            for index in domain.indices:
+                name = '{0}-{1}'.format(domain.name, index.name)
+                if config.html_domain_indices is not True and name not in config.html_domain_indices:
+                    continue
+                if index(domain).generate()[0]:
+                    names.add(name + suffix)
+
+    # Extra files copied as-is.
+    for entry in config.html_extra_path:
+        path = os.path.join(app.confdir, entry)
+        if os.path.isdir(path):
+            names.update(os.listdir(path))
+        elif os.path.exists(path):
+            names.add(os.path.basename(path))
+
+    return names
+
+
+def versions_context(versions, current_name, is_root, banner_main_name=None, banner_greatest_tag=False,
+                     banner_recent_tag=False):
+    """Get the Jinja2 HTML context values used by versions.html and banner.html.
+
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param str current_name: The ref name of the current version.
+    :param bool is_root: Is this build in the web root?
+    :param str banner_main_name: Banner URLs point to this remote name. None if the banner isn't shown.
+    :param bool banner_greatest_tag: Banner URLs point to greatest/highest (semver) tag.
+    :param bool banner_recent_tag: Banner URLs point to most recently committed tag.
+
+    :return: Context values.
+    :rtype: dict
+    """
+    this_remote = versions[current_name]
+    banner_main_remote = versions[banner_main_name] if banner_main_name else None
+    return dict(
+        bitbucket_version=current_name,
+        current_version=current_name,
+        github_version=current_name,
+        scv_banner_greatest_tag=banner_greatest_tag,
+        scv_banner_main_ref_is_branch=banner_main_remote['kind'] == 'heads' if banner_main_remote else None,
+        scv_banner_main_ref_is_tag=banner_main_remote['kind'] == 'tags' if banner_main_remote else None,
+        scv_banner_main_version=banner_main_remote['name'] if banner_main_remote else None,
+        scv_banner_recent_tag=banner_recent_tag,
+        scv_is_branch=this_remote['kind'] == 'heads',
+        scv_is_greatest_tag=this_remote == versions.greatest_tag_remote,
+        scv_is_recent_branch=this_remote == versions.recent_branch_remote,
+        scv_is_recent_ref=this_remote == versions.recent_remote,
+        scv_is_recent_tag=this_remote == versions.recent_tag_remote,
+        scv_is_root=is_root,
+        scv_is_tag=this_remote['kind'] == 'tags',
+        scv_show_banner=bool(banner_main_remote),
+        versions=versions,
+        vhasdoc=versions.vhasdoc,
+        vpathto=versions.vpathto,
+    )
+
+
+def render_versions_list(render, versions, context, cache):
+    """Render versions_list.html for a page. Reuses the HTML rendered for previous similar pages.
+
+    Links in the sidebar only change with the page's depth and which versions have the page. The HTML is rendered
+    once per combination with a placeholder page name, then the placeholder is replaced with the current one.
+
+    :param function render: Renders a template name with a context.
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance, its context must be context.
+    :param dict context: Jinja2 HTML context of the current page.
+    :param dict cache: Rendered HTML by page depth and vhasdoc() of all versions. Only reuse it for the same version.
+
+    :return: Rendered HTML.
+    :rtype: str
+    """
+    pagename = context['pagename']
+    names = [r['name'] for r in versions.remotes]
+    hasdoc = tuple(versions.vhasdoc(n) for n in names)
+    key = (pagename.count('/'), hasdoc)
+
+    if key not in cache:
+        placeholder = '/'.join([PAGENAME_PLACEHOLDER] * (key[0] + 1))
+        versions.context = dict(context, pagename=placeholder)
+        versions.hasdoc = dict(zip(names, hasdoc))
+        try:
+            cache[key] = (placeholder, render('versions_list.html', versions.context))
+        finally:
+            versions.context = context
+            versions.hasdoc = None
+
+    placeholder, html = cache[key]
+    return html.replace(placeholder, pagename).replace(PAGENAME_PLACEHOLDER, pagename.split('/')[-1])
 
 
 class EventHandlers(object):
     """Hold Sphinx event handlers as static or class methods.
 
-    :ivar multiprocessing.queues.Queue ABORT_AFTER_READ: Communication channel to parent process.
+    :ivar multiprocessing.connection.Connection ABORT_AFTER_READ: Communication channel to parent process.
     :ivar bool BANNER_GREATEST_TAG: Banner URLs point to greatest/highest (semver) tag.
     :ivar str BANNER_MAIN_VERSION: Banner URLs point to this remote name (from Versions.__getitem__()).
     :ivar bool BANNER_RECENT_TAG: Banner URLs point to most recently committed tag.
     :ivar str CURRENT_VERSION: Current version being built.
+    :ivar str EXPORT_ROOT: Root of a partially exported commit, warn about missing paths in it (limit_export setting).
+    :ivar str GIT_ROOT: Local git root to diff against the last build in the doctree directory (incremental setting).
     :ivar bool IS_ROOT: Value for context['scv_is_root'].
     :ivar bool SHOW_BANNER: Display the banner.
+    :ivar dict SIDEBAR_CACHE: Rendered versions_list.html by page depth and vhasdoc() of all versions.
+    :ivar str SIDEBAR_MODE: Render the sidebar and banner (inline), leave markers for inject.fill() (inject) or leave
+        empty elements for _static_json/versions.js (json).
     :ivar sphinxcontrib.versioning.versions.Versions VERSIONS: Versions class instance.
     """
 
@@ -41,21 +203,42 @@ class EventHandlers(object):
     BANNER_MAIN_VERSION = None
     BANNER_RECENT_TAG = False
     CURRENT_VERSION = None
+    EXPORT_ROOT = None
+    GIT_ROOT = None
     IS_ROOT = False
     SHOW_BANNER = False
+    SIDEBAR_CACHE = dict()
+    SIDEBAR_MODE = 'inline'
     VERSIONS = None
 
-    @staticmethod
-    def builder_inited(app):
+    @classmethod
+    def warn_not_exported(cls, paths, what):
+        """Warn about paths that don't exist because they're in the commit but weren't exported.
+
+        :param iter paths: Absolute paths used by Sphinx.
+        :param str what: What uses the paths, for the log message.
+        """
+        if not cls.EXPORT_ROOT:
+            return
+        log = logging.getLogger(__name__)
+        prefix = os.path.join(cls.EXPORT_ROOT, '')
+        for path in sorted({os.path.normpath(p) for p in paths}):
+            if path.startswith(prefix) and not os.path.exists(path):
+                log.warning('%s uses %s which was not exported (see --limit-export and --export-path).',
+                            what, os.path.relpath(path, cls.EXPORT_ROOT))
+
+    @classmethod
+    def builder_inited(cls, app):
         """Update the Sphinx builder.
 
         :param sphinx.application.Sphinx app: Sphinx application object.
         """
+        cls.warn_not_exported([p for p in sys.path if p and os.path.isabs(p)], 'sys.path')
+
         # Add this extension's _templates directory to Sphinx.
-        templates_dir = os.path.join(os.path.dirname(__file__), '_templates')
         if app.builder.name != "latex":
-            app.builder.templates.pathchain.insert(0, templates_dir)
-            app.builder.templates.loaders.insert(0, SphinxFileSystemLoader(templates_dir))
+            app.builder.templates.pathchain.insert(0, TEMPLATES_DIR)
+            app.builder.templates.loaders.insert(0, SphinxFileSystemLoader(TEMPLATES_DIR))
             app.builder.templates.templatepathlen += 1
 
         # Add versions.html to sidebar.
@@ -69,20 +252,99 @@ class EventHandlers(object):
         elif 'versions.html' not in app.config.html_sidebars['**']:
             app.config.html_sidebars['**'].append('versions.html')
 
+        # Render the sidebar and banner in the browser.
+        if cls.SIDEBAR_MODE == 'json':
+            app.config.html_static_path.append(STATIC_JSON_DIR)
+            add_js_file = getattr(app, 'add_js_file', None) or app.add_javascript  # Renamed in Sphinx 1.8.
+            add_js_file('versions.js')
+
     @classmethod
     def env_updated(cls, app, env):
-        """Abort Sphinx after initializing config and discovering all pages to build.
+        """Abort Sphinx after initializing config and discovering all pages to build. Otherwise check dependencies.
 
         :param sphinx.application.Sphinx app: Sphinx application object.
         :param sphinx.environment.BuildEnvironment env: Sphinx build environment.
         """
         if cls.ABORT_AFTER_READ:
             config = {n: getattr(app.config, n) for n in (a for a in dir(app.config) if a.startswith('scv_'))}
-            config['found_docs'] = tuple(str(d) for d in env.found_docs)
+            config['extensions'] = tuple(str(e) for e in app.config.extensions)
+            config['found_docs'] = tuple(sorted(str(d) for d in env.found_docs))
+            config['html_theme'] = str(app.config.html_theme)
             config['master_doc'] = str(app.config.master_doc)
-            cls.ABORT_AFTER_READ.put(config)
+            config['output_names'] = tuple(sorted(str(n) for n in _output_names(app, env)))
+            cls.ABORT_AFTER_READ.send(config)
             sys.exit(0)
 
+        # Look for documents including files that weren't exported.
+        for docname in sorted(env.dependencies):
+            paths = (os.path.join(app.srcdir, d) for d in env.dependencies[docname])
+            cls.warn_not_exported(paths, 'Document {0}'.format(docname))
+
+    @classmethod
+    def env_get_outdated(cls, app, env, added, changed, removed):
+        """Re-read documents changed in git since the last build that used this doctree directory.
+
+        Sphinx compares file mtimes with the time it last read each document, but exported files carry git commit dates
+        which may predate the last build. Diffing commits instead catches every changed document and dependency.
+
+        :param sphinx.application.Sphinx app: Sphinx application object.
+        :param sphinx.environment.BuildEnvironment env: Sphinx build environment (unused, see below).
+        :param set added: Documents Sphinx will read because they're new.
+        :param set changed: Documents Sphinx will read because their mtime changed.
+        :param set removed: Documents Sphinx will remove.
+
+        :return: Additional document names to read.
+        :rtype: list
+        """
+        assert changed is not None and removed is not None  # Unused, for linting.
+        if not cls.GIT_ROOT or cls.ABORT_AFTER_READ:
+            return list()
+        log = logging.getLogger(__name__)
+        env = app.env  # Some Sphinx versions pass the builder instead.
+        remote = cls.VERSIONS[cls.CURRENT_VERSION]
+        existing = sorted(set(env.found_docs) - set(added))
+
+        # Find which SHA was built last.
+        try:
+            with open(os.path.join(app.doctreedir, 'scv_sha')) as handle:
+                previous = handle.read().strip()
+        except IOError:
+            return existing  # Unknown state, read everything.
+        if previous == remote['sha']:
+            return list()
+
+        # Diff commits.
+        rel_source = os.path.dirname(remote['conf_rel_path']).replace(os.sep, '/')
+        command = ['git', 'diff', '--name-only', '-z', previous, remote['sha'], '--', rel_source or '.']
+        try:
+            output = run_command(cls.GIT_ROOT, command)
+        except CalledProcessError:
+            log.debug('Failed to diff %s with %s, reading all documents.', previous, remote['sha'])
+            return existing
+        prefix = rel_source + '/' if rel_source else ''
+        paths = {os.path.normpath(p[len(prefix):]) for p in output.split('\0') if p.startswith(prefix)}
+
+        # Map changed files to documents and documents depending on them.
+        outdated = set()
+        for docname in existing:
+            if os.path.normpath(env.doc2path(docname, None)) in paths:
+                outdated.add(docname)
+            elif any(os.path.normpath(os.path.relpath(d, app.srcdir) if os.path.isabs(d) else d) in paths
+                     for d in env.dependencies.get(docname, ())):
+                outdated.add(docname)
+        return sorted(outdated)
+
+    @classmethod
+    def build_finished(cls, app, exception):
+        """Remember which SHA was built in the doctree directory for env_get_outdated() on the next run.
+
+        :param sphinx.application.Sphinx app: Sphinx application object.
+        :param Exception exception: Exception raised during the build or None.
+        """
+        if cls.GIT_ROOT and exception is None:
+            with open(os.path.join(app.doctreedir, 'scv_sha'), 'w') as handle:
+                handle.write(cls.VERSIONS[cls.CURRENT_VERSION]['sha'])
+
     @classmethod
     def html_page_context(cls, app, pagename, templatename, context, doctree):
         """Update the Jinja2 HTML context, exposes the Versions class instance to it.
@@ -95,36 +357,29 @@ class EventHandlers(object):
         """
         assert templatename or doctree  # Unused, for linting.
         cls.VERSIONS.context = context
-        versions = cls.VERSIONS
-        this_remote = versions[cls.CURRENT_VERSION]
-        banner_main_remote = versions[cls.BANNER_MAIN_VERSION] if cls.SHOW_BANNER else None
+        banner_main_name = cls.BANNER_MAIN_VERSION if cls.SHOW_BANNER else None
 
         # Update Jinja2 context.
-        context['bitbucket_version'] = cls.CURRENT_VERSION
-        context['current_version'] = cls.CURRENT_VERSION
-        context['github_version'] = cls.CURRENT_VERSION
+        context.update(versions_context(cls.VERSIONS, cls.CURRENT_VERSION, cls.IS_ROOT, banner_main_name,
+                                        cls.BANNER_GREATEST_TAG, cls.BANNER_RECENT_TAG))
         context['html_theme'] = app.config.html_theme
-        context['scv_banner_greatest_tag'] = cls.BANNER_GREATEST_TAG
-        context['scv_banner_main_ref_is_branch'] = banner_main_remote['kind'] == 'heads' if cls.SHOW_BANNER else None
-        context['scv_banner_main_ref_is_tag'] = banner_main_remote['kind'] == 'tags' if cls.SHOW_BANNER else None
-        context['scv_banner_main_version'] = banner_main_remote['name'] if cls.SHOW_BANNER else None
-        context['scv_banner_recent_tag'] = cls.BANNER_RECENT_TAG
-        context['scv_is_branch'] = this_remote['kind'] == 'heads'
-        context['scv_is_greatest_tag'] = this_remote == versions.greatest_tag_remote
-        context['scv_is_recent_branch'] = this_remote == versions.recent_branch_remote
-        context['scv_is_recent_ref'] = this_remote == versions.recent_remote
-        context['scv_is_recent_tag'] = this_remote == versions.recent_tag_remote
-        context['scv_is_root'] = cls.IS_ROOT
-        context['scv_is_tag'] = this_remote['kind'] == 'tags'
-        context['scv_show_banner'] = cls.SHOW_BANNER
-        context['versions'] = versions
-        context['vhasdoc'] = versions.vhasdoc
-        context['vpathto'] = versions.vpathto
+        context['scv_versions_html'] = functools.partial(cls.versions_html, app, context)
+
+        # Page info for _static_json/versions.js.
+        if cls.SIDEBAR_MODE == 'json':
+            content = html.escape(json.dumps(cls.marker_values(app, pagename), sort_keys=True))
+            metatag = '<meta name="scv-versions" content="{0}" />'.format(content)
+            context['metatags'] = context.get('metatags', '') + metatag
 
         # Insert banner into body.
-        if cls.SHOW_BANNER and 'body' in context:
+        if cls.SIDEBAR_MODE == 'inject' and 'body' in context:
+            context['body'] = marker('banner', cls.marker_values(app, pagename)) + context['body']
+        elif cls.SIDEBAR_MODE == 'json' and 'body' in context:
+            context['body'] = '<div class="scv-banner-slot"></div>' + context['body']
+        elif cls.SHOW_BANNER and 'body' in context:
             parsed = app.builder.templates.render('banner.html', context)
             context['body'] = parsed + context['body']
+        if (cls.SHOW_BANNER or cls.SIDEBAR_MODE != 'inline') and 'body' in context:
             # Handle overridden css_files.
             css_files = context.setdefault('css_files', list())
             if '_static/banner.css' not in css_files:
@@ -141,6 +396,35 @@ class EventHandlers(object):
                 mtime = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
                 context['last_updated'] = format_date(lufmt, mtime, language=app.config.language)
 
+    @classmethod
+    def marker_values(cls, app, pagename):
+        """Values inject.fill() or _static_json/versions.js need to render the banner and sidebar of a page.
+
+        :param sphinx.application.Sphinx app: Sphinx application object.
+        :param str pagename: Name of the page being rendered.
+
+        :return: JSON serializable values.
+        :rtype: dict
+        """
+        return dict(pagename=pagename, project=app.config.project, root=cls.IS_ROOT, theme=app.config.html_theme,
+                    version=cls.CURRENT_VERSION)
+
+    @classmethod
+    def versions_html(cls, app, context):
+        """Render versions_list.html, called by versions.html.
+
+        :param sphinx.application.Sphinx app: Sphinx application object.
+        :param dict context: Jinja2 HTML context of the current page.
+
+        :return: Rendered HTML.
+        :rtype: str
+        """
+        if cls.SIDEBAR_MODE == 'inject':
+            return marker('versions', cls.marker_values(app, context['pagename']))
+        if cls.SIDEBAR_MODE == 'json':
+            return '<div class="scv-versions"></div>'
+        return render_versions_list(app.builder.templates.render, cls.VERSIONS, context, cls.SIDEBAR_CACHE)
+
 
 def setup(app):
     """Called by Sphinx during phase 0 (initialization).
@@ -163,7 +447,9 @@ def setup(app):
 
     # Event handlers.
     app.connect('builder-inited', EventHandlers.builder_inited)
+    app.connect('env-get-outdated', EventHandlers.env_get_outdated)
     app.connect('env-updated', EventHandlers.env_updated)
+    app.connect('build-finished', EventHandlers.build_finished)
     app.connect('html-page-context', EventHandlers.html_page_context)
     return dict(version=__version__)
 
@@ -194,9 +480,15 @@ def _build(argv, config, versions, current_name, is_root):
         EventHandlers.BANNER_RECENT_TAG = config.banner_recent_tag
         EventHandlers.SHOW_BANNER = True
     EventHandlers.CURRENT_VERSION = current_name
+    if config.limit_export and versions.remotes:
+        rel_source = os.path.dirname(versions[current_name]['conf_rel_path'])
+        EventHandlers.EXPORT_ROOT = os.path.normpath(os.path.join(argv[0], os.path.relpath('.', rel_source or '.')))
+    EventHandlers.GIT_ROOT = config.git_root if config.incremental else None
     EventHandlers.IS_ROOT = is_root
+    EventHandlers.SIDEBAR_CACHE = dict()
+    EventHandlers.SIDEBAR_MODE = config.sidebar_mode
     EventHandlers.VERSIONS = versions
-    SC_VERSIONING_VERSIONS[:] = [p for r in versions.remotes for p in sorted(r.items()) if p[0] not in ('sha', 'date')]
+    SC_VERSIONING_VERSIONS[:] = versions.flatten() if config.sidebar_mode == 'inline' else list()
 
     # Update argv.
     if config.verbose > 1:
@@ -227,21 +519,361 @@ def _build(argv, config, versions, current_name, is_root):
         raise SphinxError
 
 
-def _read_config(argv, config, current_name, queue):
+def _read_config(argv, config, current_name, pipe):
     """Read the Sphinx config via multiprocessing for isolation.
 
     :param tuple argv: Arguments to pass to Sphinx.
     :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
     :param str current_name: The ref name of the current version being built.
-    :param multiprocessing.queues.Queue queue: Communication channel to parent process.
+    :param multiprocessing.connection.Connection pipe: Communication channel to parent process.
     """
     # Patch.
-    EventHandlers.ABORT_AFTER_READ = queue
+    EventHandlers.ABORT_AFTER_READ = pipe
 
     # Run.
     _build(argv, config, Versions(list()), current_name, False)
 
 
+def _isolated(target, args, pipe, cwd):
+    """Run target(*args) in a child forked from this worker process, like multiprocessing.Process would.
+
+    Imported modules are shared with the worker but nothing the child does (patched classes, Sphinx state, leaks) is.
+
+    :param function target: Function to run in the child.
+    :param tuple args: Arguments for target.
+    :param bool pipe: Append the sending end of a pipe to args. The last object the child sends is returned.
+    :param str cwd: Working directory of the parent process.
+
+    :return: Exit code and object sent by the child or None.
+    :rtype: tuple
+    """
+    reader, writer = multiprocessing.Pipe(False) if pipe else (None, None)
+    pid = os.fork()
+    if not pid:
+        exitcode = 1
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            if pipe:
+                reader.close()
+            os.chdir(cwd)
+            target(*(args + ((writer,) if pipe else ())))
+            exitcode = 0
+        except SystemExit as exc:
+            exitcode = exc.code if isinstance(exc.code, int) else int(exc.code is not None)
+        except BaseException:  # pylint: disable=broad-except
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exitcode)  # pylint: disable=protected-access
+
+    payload = None
+    if pipe:
+        writer.close()
+        while True:
+            try:
+                payload = reader.recv()
+            except EOFError:
+                break
+        reader.close()
+    status = os.waitpid(pid, 0)[1]
+    return (os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)), payload
+
+
+def _init_worker(verbose, colors):
+    """Set up a worker process of WorkerPool.
+
+    Ctrl+C interrupts the children of workers but not workers themselves, a worker interrupted while waiting for work
+    leaves the pool's task queue locked and WorkerPool.close() hanging.
+
+    :param int verbose: Verbosity level.
+    :param bool colors: Print color text.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(verbose, colors)
+
+
+class WorkerPool(object):
+    """Long-lived worker processes started by a forkserver which already imported Sphinx, themes and extensions.
+
+    Workers only fork: each build still runs in its own child process (see _isolated()) so builds are as isolated from
+    each other as with one multiprocessing.Process per build, minus the imports. Workers are replaced after a number of
+    builds to bound their memory. The forkserver starts (importing in the background) when this class is instantiated,
+    worker processes on first use. Both are stopped by close(), or at exit.
+
+    :ivar multiprocessing.context.ForkServerContext context: Multiprocessing context using the forkserver.
+    :ivar multiprocessing.pool.Pool pool: Worker processes, None until first used.
+    :ivar list preload: Modules imported in the forkserver.
+    :ivar int processes: Number of worker processes.
+    """
+
+    INSTANCE = None
+    POLL_SECONDS = 1
+
+    def __init__(self, processes, max_builds, preload, verbose, colors):
+        """Constructor.
+
+        :param int processes: Number of worker processes.
+        :param int max_builds: Replace a worker process after this many builds.
+        :param iter preload: Additional modules to import in the forkserver. Modules that fail to import are skipped.
+        :param int verbose: Verbosity level of worker processes.
+        :param bool colors: Print color text in worker processes.
+        """
+        self.preload = ['sphinx.application', 'sphinx.builders.html', 'sphinx.cmd.build',
+                        'sphinxcontrib.versioning.sphinx_']
+        self.preload.extend(m for m in dict.fromkeys(preload) if m and m not in self.preload)
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(self.preload)
+        forkserver.ensure_running()
+        self.processes = processes
+        self.pool = None
+        self._pool_args = (processes, _init_worker, (verbose, colors), max_builds)
+
+    @classmethod
+    def get(cls, config, preload=()):
+        """Get the worker pool, starting it if needed. Not available on platforms without fork().
+
+        :param sphinxcontrib.versioning.lib.Config config: Runtime configuration.
+        :param iter preload: Modules to import in the forkserver besides the preload setting, if it didn't start yet.
+
+        :return: Instance of this class or None.
+        :rtype: WorkerPool
+        """
+        if cls.INSTANCE is None:
+            if 'forkserver' not in multiprocessing.get_all_start_methods():
+                logging.getLogger(__name__).warning('Worker pool not supported on this platform, ignoring.')
+                return None
+            cls.INSTANCE = cls(max(config.jobs, 1), config.worker_builds, list(config.preload) + list(preload),
+                               config.verbose, not config.no_colors)
+        return cls.INSTANCE
+
+    @classmethod
+    def close(cls):
+        """Stop the worker processes."""
+        if cls.INSTANCE is not None and cls.INSTANCE.pool is not None:
+            cls.INSTANCE.pool.terminate()
+            cls.INSTANCE.pool.join()
+        cls.INSTANCE = None
+
+    def broken(self, workers):
+        """Check if the pool lost work: a worker crashed or no new workers can be started.
+
+        Workers replaced after max_builds exit with 0. Workers crash e.g. when a task can't be unpickled, the task is
+        lost and Pool silently starts another worker. If the forkserver died (e.g. a preloaded module exited) Pool's
+        worker handler thread stops.
+
+        :param iter workers: multiprocessing.Process instances of workers seen so far.
+
+        :return: True if waiting for results would never end.
+        :rtype: bool
+        """
+        if not self.pool._worker_handler.is_alive():  # pylint: disable=protected-access
+            return True
+        return any(w.exitcode not in (None, 0) for w in workers)
+
+    def run(self, children, jobs, started=None, pipe=False):
+        """Same as _run_children() but in worker processes.
+
+        Falls back to _run_children() without the worker pool for unfinished children if the pool breaks. The worker
+        pool setting is then disabled.
+
+        :param iter children: Tuples of (item, target, args). Item identifies the child, target(*args) runs in the
+            child.
+        :param int jobs: Maximum number of concurrent child processes, up to the number of worker processes.
+        :param function started: Called with item right before its child process starts.
+        :param bool pipe: Append the sending end of a pipe to args. The last object the child sends is returned.
+
+        :return: Tuples of (item, exit code, object sent by the child or None), in the order children exited.
+        :rtype: list
+        """
+        log = logging.getLogger(__name__)
+        children = list(children)
+        pending = list(range(len(children)))
+        finished = queue.Queue()
+        running = 0
+        results = dict()
+        workers = dict()
+
+        def fallback():
+            """Stop using the broken pool and run unfinished children without it.
+
+            :return: Same as run().
+            :rtype: list
+            """
+            log.warning('Worker pool failed, running the remaining sphinx-build runs without it.')
+            self.close()
+            Config.from_context().update(dict(worker_pool=False), overwrite=True)
+            remaining = [children[i] for i in range(len(children)) if i not in results]
+            return [(children[i][0],) + r for i, r in results.items()] + _run_children(
+                remaining, jobs, started, pipe, worker_pool=False)
+
+        if self.pool is None:
+            try:
+                self.pool = self.context.Pool(*self._pool_args)
+            except (EOFError, OSError) as exc:  # Forkserver died, e.g. a preloaded module exited.
+                log.debug('Unable to start worker processes: %s', exc)
+                return fallback()
+
+        def failed(index, exc):
+            """Worker couldn't run a child.
+
+            :param int index: Index of `children`.
+            :param Exception exc: Exception raised by the pool.
+            """
+            log.debug('Worker process failed: %s', exc)
+            finished.put((index, 1, None))
+
+        while pending or running:
+            while pending and running < min(max(jobs, 1), self.processes):
+                index = pending.pop(0)
+                item, target, args = children[index]
+                if started:
+                    started(item)
+                self.pool.apply_async(_isolated, (target, args, pipe, os.getcwd()),
+                                      callback=functools.partial(lambda i, r: finished.put((i,) + tuple(r)), index),
+                                      error_callback=functools.partial(failed, index))
+                running += 1
+            while True:
+                workers.update((w.pid, w) for w in list(self.pool._pool))  # pylint: disable=protected-access
+                try:
+                    index, exitcode, payload = finished.get(timeout=self.POLL_SECONDS)
+                except queue.Empty:
+                    if not self.broken(workers.values()):
+                        continue
+                    return fallback()
+                results[index] = (exitcode, payload)
+                running -= 1
+                break
+
+        return [(children[i][0],) + r for i, r in results.items()]
+
+
+atexit.register(WorkerPool.close)
+
+
+def _run_children(children, jobs, started=None, pipe=False, worker_pool=True):
+    """Run functions in child processes, up to `jobs` of them at the same time. Children are started in the order given.
+
+    Children are forked from the worker pool instead of this process when `worker_pool` and the worker_pool setting are
+    enabled.
+
+    :param iter children: Tuples of (item, target, args). Item identifies the child, target(*args) runs in the child.
+    :param int jobs: Maximum number of concurrent child processes.
+    :param function started: Called with item right before its child process starts.
+    :param bool pipe: Append the sending end of a pipe to args. The last object the child sends is returned.
+    :param bool worker_pool: Allow using the worker pool.
+
+    :return: Tuples of (item, exit code, object sent by the child or None), in the order children exited.
+    :rtype: list
+    """
+    config = Config.from_context()
+    pool = WorkerPool.get(config) if worker_pool and config.worker_pool else None
+    if pool is not None:
+        return pool.run(children, jobs, started, pipe)
+
+    pending = list(children)
+    running = dict()
+    results = list()
+
+    while pending or running:
+        # Fill up the pool.
+        while pending and len(running) < max(jobs, 1):
+            item, target, args = pending.pop(0)
+            if started:
+                started(item)
+            reader, writer = multiprocessing.Pipe(False) if pipe else (None, None)
+            child = multiprocessing.Process(target=target, args=args + ((writer,) if pipe else ()))
+            child.start()
+            if pipe:
+                writer.close()
+            running[child.sentinel] = [child, item, reader, None]
+
+        # Block until a child sends something or exits. Children may block on sending so always drain pipes.
+        readers = {s[2]: s for s in running.values() if s[2] is not None}
+        for ready in wait(list(readers) + list(running)):
+            if ready in readers:
+                state = readers[ready]
+                try:
+                    state[3] = ready.recv()
+                except EOFError:
+                    state[2] = None
+                    ready.close()
+                continue
+            child, item, reader, payload = running.pop(ready)
+            child.join()
+            if reader is not None:
+                while reader.poll():
+                    try:
+                        payload = reader.recv()
+                    except EOFError:
+                        break
+                reader.close()
+            results.append((item, child.exitcode, payload))
+
+    return results
+
+
+def build_many(builds, versions, jobs, stop_on_failure=False):
+    """Build Sphinx docs for several versions, running up to `jobs` sphinx-build child processes at the same time.
+
+    Builds are started in the order given, except that builds sharing a source directory (e.g. the root ref and its own
+    subdirectory) never run at the same time since extensions may write into it. Those run in a later wave, after all
+    builds of the previous one finished. Unlike build() a failure doesn't raise, all builds run to completion unless
+    `stop_on_failure` is set.
+
+    :param iter builds: Tuples of (source, target, current_name, is_root[, doctrees]), one per sphinx-build run.
+        Optional doctrees is the doctree/environment directory to pass to sphinx-build.
+    :param sphinxcontrib.versioning.versions.Versions versions: Versions class instance.
+    :param int jobs: Maximum number of concurrent child processes.
+    :param bool stop_on_failure: Run builds one at a time and don't start any after one failed.
+
+    :return: Items of `builds` whose sphinx-build failed (logged before returning) and items that weren't run.
+    :rtype: tuple
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+
+    def started(item):
+        """Log before starting a child.
+
+        :param tuple item: Item of `builds`.
+        """
+        log.info('Building %s: %s', 'root' if item[3] else 'ref', item[2])
+        log.debug('Running sphinx-build for %s with args: %s', item[2], str(argv(item)))
+
+    def argv(item):
+        """Get sphinx-build arguments.
+
+        :param tuple item: Item of `builds`.
+
+        :return: Arguments.
+        :rtype: tuple
+        """
+        return item[:2] + (('-d', item[4]) if item[4:] and item[4] else ())
+
+    # Group builds into waves without shared source directories.
+    waves = list()
+    for item in builds:
+        wave = next((w for w in waves if item[0] not in w), None)
+        if wave is None:
+            wave = dict()
+            waves.append(wave)
+        wave.setdefault(item[0], item)
+
+    failed, not_run = list(), list()
+    for wave in waves:
+        for group in ([[i] for i in wave.values()] if stop_on_failure else [list(wave.values())]):
+            if stop_on_failure and failed:
+                not_run.extend(group)
+                continue
+            children = [(i, _build, (argv(i), config, versions, i[2], i[3])) for i in group]
+            for item, exitcode, _ in _run_children(children, jobs, started):
+                if exitcode != 0:
+                    log.error('sphinx-build failed for branch/tag: %s', item[2])
+                    failed.append(item)
+    return failed, not_run
+
+
 def build(source, target, versions, current_name, is_root):
     """Build Sphinx docs for one version. Includes Versions class instance with names/urls in the HTML context.
 
@@ -258,38 +890,62 @@ def build(source, target, versions, current_name, is_root):
     config = Config.from_context()
 
     log.debug('Running sphinx-build for %s with args: %s', current_name, str(argv))
-    child = multiprocessing.Process(target=_build, args=(argv, config, versions, current_name, is_root))
-    child.start()
-    child.join()  # Block.
-    if child.exitcode != 0:
-        log.error('sphinx-build failed for branch/tag: %s', current_name)
-        raise HandledError
+    for _, exitcode, _ in _run_children([(None, _build, (argv, config, versions, current_name, is_root))], 1):
+        if exitcode != 0:
+            log.error('sphinx-build failed for branch/tag: %s', current_name)
+            raise HandledError
+
+
+def read_configs(sources, jobs, worker_pool=True):
+    """Read the Sphinx config for several versions, running up to `jobs` child processes at the same time.
 
+    :param iter sources: Tuples of (source, current_name[, doctrees]). Source directory to pass to sphinx-build, ref
+        name and optional doctree/environment directory to pass to sphinx-build.
+    :param int jobs: Maximum number of concurrent child processes.
+    :param bool worker_pool: Allow using the worker pool.
 
-def read_config(source, current_name):
+    :return: Specific Sphinx config values for each item of `sources` in the same order. None if sphinx-build failed.
+    :rtype: list
+    """
+    log = logging.getLogger(__name__)
+    config = Config.from_context()
+    sources = list(sources)
+    temp_dirs = [TempDir() for _ in sources]
+    children = list()
+    for i, (source, current_name) in enumerate(s[:2] for s in sources):
+        argv = (source, temp_dirs[i].name) + (('-d', sources[i][2]) if sources[i][2:] and sources[i][2] else ())
+        children.append((i, _read_config, (argv, config, current_name)))
+
+    def started(index):
+        """Log before starting a child.
+
+        :param int index: Index of `sources`.
+        """
+        log.debug('Running sphinx-build for config values with args: %s', str(children[index][2][0]))
+
+    configs = [None] * len(children)
+    for index, exitcode, payload in _run_children(children, jobs, started, pipe=True, worker_pool=worker_pool):
+        temp_dirs[index].cleanup()
+        if exitcode != 0 or payload is None:
+            log.error('sphinx-build failed for branch/tag while reading config: %s', sources[index][1])
+            continue
+        configs[index] = payload
+    return configs
+
+
+def read_config(source, current_name, worker_pool=True):
     """Read the Sphinx config for one version.
 
     :raise HandledError: If sphinx-build fails. Will be logged before raising.
 
     :param str source: Source directory to pass to sphinx-build.
     :param str current_name: The ref name of the current version being built.
+    :param bool worker_pool: Allow using the worker pool.
 
     :return: Specific Sphinx config values.
     :rtype: dict
     """
-    log = logging.getLogger(__name__)
-    queue = multiprocessing.Queue()
-    config = Config.from_context()
-
-    with TempDir() as temp_dir:
-        argv = (source, temp_dir)
-        log.debug('Running sphinx-build for config values with args: %s', str(argv))
-        child = multiprocessing.Process(target=_read_config, args=(argv, config, current_name, queue))
-        child.start()
-        child.join()  # Block.
-        if child.exitcode != 0:
-            log.error('sphinx-build failed for branch/tag while reading config: %s', current_name)
-            raise HandledError
-
-    config = queue.get()
+    config = read_configs([(source, current_name)], 1, worker_pool)[0]
+    if config is None:
+        raise HandledError
     return config
@@ -1,55 +1,82 @@
 """Collect and sort version strings."""
 
+import bisect
+import functools
 import re
 import os
 
+PRE_RELEASE_RANKS = dict(a=0, alpha=0, b=1, beta=1, c=2, rc=2, pre=2, preview=2)
+RE_PEP440_SUFFIX = re.compile(r'^(?:[-_.]?(a|alpha|b|beta|c|rc|pre|preview)[-_.]?(\d*))?'
+                              r'(?:[-_.]?(post|rev|r)[-_.]?(\d*))?'
+                              r'(?:[-_.]?(dev)[-_.]?(\d*))?(?:\+[a-z0-9.]*)?$', re.IGNORECASE)
 RE_SEMVER = re.compile(r'^v?V?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:\.(\d+))?(?:\.(\d+))?(?:\.(\d+))?(?:\.(\d+))?([\w.+-]*)$')
 
 
-def semvers(names):
-    """Parse versions into integers and convert non-integer meta indicators into integers with ord().
+@functools.lru_cache(maxsize=None)
+def semver_key(name):
+    """Parse a version into a flat tuple sort key, latest version first. Cached since the same names are sorted several
+    times.
+
+    Valid versions start with 0, invalid ones (e.g. master, feature_branch, etc) are (1,) to sort them after valid
+    versions. Integers are inverted so higher versions sort first, see multi_sort().
+
+    Suffixes follow PEP 440 ordering when they can: post-releases, then the final release, then release candidates,
+    betas, alphas and dev releases. Other suffixes sort after those, by character.
 
-    Each return list item has an indicator as the first item. 0 for valid versions and 1 for invalid. Can be used to
-    sort non-version names (e.g. master, feature_branch, etc) after valid versions. No sorting is done in this function
-    though.
+    :param str name: String representing a version/tag/branch.
 
-    Read multi_sort() docstring for reasoning behind inverted integers in version_ints variable.
+    :return: Sort key. E.g. v1.10.0b3 -> (0, -1, -10, 0, 0, 0, 0, 0, 0, 1, -1, -3, 1, 0, 0, 0)
+    :rtype: tuple
+    """
+    match = RE_SEMVER.match(name)
+    if not match:
+        return (1,)
+    groups = match.groups()
+    version_ints = tuple([0] + [-int(i) if i else 0 for i in groups[:-1]])
+
+    pep440 = RE_PEP440_SUFFIX.match(groups[-1])
+    if not pep440:
+        return version_ints + (1,) + tuple(ord(i) for i in groups[-1])
+    pre, pre_num, post, post_num, dev, dev_num = pep440.groups()
+    if pre:
+        pre_key = (1, -PRE_RELEASE_RANKS[pre.lower()], -int(pre_num or 0))
+    elif dev and not post:
+        pre_key = (2, 0, 0)  # Dev release of the final release, before any pre-release.
+    else:
+        pre_key = (0, 0, 0)
+    post_key = (0, -int(post_num or 0)) if post else (1, 0)
+    dev_key = (1, -int(dev_num or 0)) if dev else (0, 0)
+    return version_ints + (0,) + pre_key + post_key + dev_key
+
+
+def is_prerelease(name):
+    """Check if a version is a PEP 440 pre-release or dev release (e.g. v1.1.0rc1 or 1.1.dev3).
+
+    :param str name: String representing a version/tag/branch.
+
+    :return: True for pre-releases, False for releases and strings that aren't versions.
+    :rtype: bool
+    """
+    match = RE_SEMVER.match(name)
+    pep440 = RE_PEP440_SUFFIX.match(match.groups()[-1]) if match else None
+    return bool(pep440 and (pep440.group(1) or pep440.group(5)))
+
+
+def semvers(names):
+    """Parse versions into sort keys with semver_key().
 
     :param iter names: List of strings representing versions/tags/branches.
 
-    :return: List of parsed versions. E.g. v1.10.0b3 -> [0, 1, 10, 0, ord('b'), ord('3')]
+    :return: List of parsed versions.
     :rtype: list
     """
-    matches = [(RE_SEMVER.findall(n) or [[]])[0] for n in names]
-    max_len_ints = 0
-    max_len_str = 0
-
-    # Get max lens for padding.
-    for match in (m for m in matches if m):
-        max_len_ints = len(match)  # Never changes.
-        max_len_str = max(max_len_str, len(match[-1]))
-    if not max_len_ints:
-        return matches  # Nothing to do, all empty.
-    invalid_template = [1] + [0] * (max_len_ints + max_len_str - 1)
-
-    # Parse.
-    exploded_semver = list()
-    for match in matches:
-        if not match:
-            exploded_semver.append(invalid_template[:])
-            continue
-        version_ints = [-int(i or 0) for i in match[:-1]]
-        ints_of_str = [ord(i) for i in match[-1]] + [0] * (max_len_str - len(match[-1]))
-        exploded_semver.append([0] + version_ints + ints_of_str)
-
-    return exploded_semver
+    return [semver_key(n) for n in names]
 
 
 def multi_sort(remotes, sort):
     """Sort `remotes` in place. Allows sorting by multiple conditions.
 
-    This is needed because Python 3 no longer supports sorting lists of multiple types. Sort keys must all be of the
-    same type.
+    Each remote gets one tuple key with an item per condition, conditions of the same kind compare equal types.
 
     Problem: the user expects versions to be sorted latest first and timelogical to be most recent first (when viewing
     the HTML documentation), yet expects alphabetical sorting to be A before Z.
@@ -58,42 +85,119 @@ def multi_sort(remotes, sort):
     :param iter remotes: List of dicts from Versions().remotes.
     :param iter sort: What to sort by. May be one or more of: alpha, time, semver
     """
-    exploded_alpha = list()
-    exploded_semver = list()
-
-    # Convert name to int if alpha is in sort.
-    if 'alpha' in sort:
-        alpha_max_len = max(len(r['name']) for r in remotes)
-        for name in (r['name'] for r in remotes):
-            exploded_alpha.append([ord(i) for i in name] + [0] * (alpha_max_len - len(name)))
-
-    # Parse versions if semver is in sort.
-    if 'semver' in sort:
-        exploded_semver = semvers(r['name'] for r in remotes)
-
-    # Build sort_mapping dict.
-    sort_mapping = dict()
-    for i, remote in enumerate(remotes):
-        key = list()
-        for sort_by in sort:
-            if sort_by == 'alpha':
-                key.extend(exploded_alpha[i])
-            elif sort_by == 'time':
-                key.append(-remote['date'])
-            elif sort_by == 'semver':
-                key.extend(exploded_semver[i])
-        sort_mapping[id(remote)] = key
-
-    # Sort.
-    remotes.sort(key=lambda k: sort_mapping.get(id(k)))
+    getters = dict(
+        alpha=lambda r: r['name'],
+        semver=lambda r: semver_key(r['name']),
+        time=lambda r: -r['date'],
+    )
+    getters = [getters[s] for s in sort if s in getters]
+    if len(getters) == 1:
+        remotes.sort(key=getters[0])
+    else:
+        remotes.sort(key=lambda r: tuple([g(r) for g in getters]))
+
+
+class Remotes(list):
+    """List of version dicts with hash indexes for Versions.__getitem__(). Indexes are rebuilt after the list changes.
+
+    Version dicts' id, sha, name and date values must not change while they're in the list.
+
+    :ivar dict indexes: Lookup tables, None until next needed.
+    """
+
+    KEYS = ('id', 'sha', 'name', 'date')
+
+    def __init__(self, *args):
+        """Constructor."""
+        super(Remotes, self).__init__(*args)
+        self.indexes = None
+
+    def get_indexes(self):
+        """Build indexes if the list changed since they were last built.
+
+        :return: Dict of KEYS to dicts of values to the first version dict with that value, plus "sha_prefix": sorted
+            list of (sha, list index) tuples.
+        :rtype: dict
+        """
+        if self.indexes is None:
+            self.indexes = dict((k, dict()) for k in self.KEYS)
+            for remote in self:
+                for key in self.KEYS:
+                    self.indexes[key].setdefault(remote[key], remote)
+            self.indexes['sha_prefix'] = sorted((r['sha'], i) for i, r in enumerate(self))
+        return self.indexes
+
+    def lookup(self, item):
+        """Find the first version whose id, sha, name or date (in that order of precedence) equals item.
+
+        :param item: Value to look for.
+
+        :return: Version dict or None if nothing matched.
+        :rtype: dict
+        """
+        indexes = self.get_indexes()
+        for key in self.KEYS:
+            try:
+                remote = indexes[key].get(item)
+            except TypeError:  # Unhashable.
+                return None
+            if remote is not None:
+                return remote
+        return None
+
+    def lookup_sha(self, item):
+        """Find the first version whose SHA starts with item, or else contains it.
+
+        :param str item: Abbreviated SHA or any substring of one.
+
+        :return: Version dict or None if nothing matched.
+        :rtype: dict
+        """
+        shas = self.get_indexes()['sha_prefix']
+        start = bisect.bisect_left(shas, (item,))
+        end = start
+        while end < len(shas) and shas[end][0].startswith(item):
+            end += 1
+        if end > start:
+            return self[min(i for _, i in shas[start:end])]
+        for remote in self:
+            if item in remote['sha']:
+                return remote
+        return None
+
+
+def _invalidating(name):
+    """Wrap a list method so Remotes indexes are rebuilt after it's called.
+
+    :param str name: Method name.
+
+    :return: Wrapped method.
+    :rtype: function
+    """
+    method = getattr(list, name)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """Drop indexes and call the list method."""
+        self.indexes = None
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+for _name in ('__delitem__', '__iadd__', '__imul__', '__setitem__', 'append', 'clear', 'extend', 'insert', 'pop',
+              'remove', 'reverse', 'sort'):
+    setattr(Remotes, _name, _invalidating(_name))
 
 
 class Versions(object):
     """Iterable class that holds all versions and handles sorting and filtering. To be fed into Sphinx's Jinja2 env.
 
-    :ivar iter remotes: List of dicts for every branch/tag.
+    :ivar Remotes remotes: List of dicts for every branch/tag.
     :ivar dict context: Current Jinja2 context, provided by Sphinx's html-page-context API hook.
+    :ivar dict docs: Document names of all versions mapped to their bit in each version's found_docs bitmask.
+    :ivar dict doc_bits: Bits set in each version's found_docs bitmask as frozensets, by version id. For lookups.
     :ivar dict greatest_tag_remote: Tag with the highest version number if it's a valid semver.
+    :ivar dict hasdoc: Override vhasdoc() results by version name, used when context['pagename'] is a placeholder.
     :ivar dict recent_branch_remote: Most recently committed branch.
     :ivar dict recent_remote: Most recently committed branch/tag.
     :ivar dict recent_tag_remote: Most recently committed tag.
@@ -107,19 +211,22 @@ class Versions(object):
         :param str priority: May be "branches" or "tags". Groups either before the other. Maintains order otherwise.
         :param bool invert: Invert sorted/grouped remotes at the end of processing.
         """
-        self.remotes = [dict(
+        self.remotes = Remotes(dict(
             id='/'.join(r[2:0:-1]),  # str; kind/name
             sha=r[0],  # str
             name=r[1],  # str
             kind=r[2],  # str
             date=r[3],  # int
             conf_rel_path=r[4],  # str
-            found_docs=tuple(),  # tuple of str
+            found_docs=0,  # int; bitmask over self.docs
             master_doc='contents',  # str
             root_dir=r[1],  # str
-        ) for r in remotes]
+        ) for r in remotes)
         self.context = dict()
+        self.docs = dict()
+        self.doc_bits = dict()
         self.greatest_tag_remote = None
+        self.hasdoc = None
         self.recent_branch_remote = None
         self.recent_remote = None
         self.recent_tag_remote = None
@@ -167,19 +274,18 @@ class Versions(object):
     def __getitem__(self, item):
         """Retrieve a version dict from self.remotes by any of its attributes."""
         # First assume item is an attribute.
-        for key in ('id', 'sha', 'name', 'date'):
-            for remote in self.remotes:
-                if remote[key] == item:
-                    return remote
+        remote = self.remotes.lookup(item)
+        if remote is not None:
+            return remote
         # Next assume item is a substring of a sha.
         try:
             length = len(item)
         except TypeError:  # Not an int.
             length = 0
-        if length >= 5:
-            for remote in self.remotes:
-                if item in remote['sha']:
-                    return remote
+        if length >= 5 and isinstance(item, str):
+            remote = self.remotes.lookup_sha(item)
+            if remote is not None:
+                return remote
         # Finally assume it's an index. Raises IndexError if item is int.
         try:
             return self.remotes[item]
@@ -204,6 +310,32 @@ class Versions(object):
         """Return list of (name and urls, pdf_urls) only tags."""
         return [(r['name'], self.vpathto(r['name']), self.pathtopdf(r['name'])) for r in self.remotes if r['kind'] == 'tags']
 
+    def flatten(self):
+        """Return a flat list of (key, value) pairs of every version's attributes visible in the HTML output.
+
+        Excludes attributes that don't change rendered pages (sha and date). Changes whenever the sidebar does.
+
+        found_docs bitmasks are preceded by the document names table they refer to.
+
+        :return: List of 2-item tuples, sorted by key within each version.
+        :rtype: list
+        """
+        flattened = [p for r in self.remotes for p in sorted(r.items()) if p[0] not in ('sha', 'date')]
+        return [('docs', tuple(self.docs))] + flattened
+
+    def set_found_docs(self, remote, found_docs):
+        """Set a version's found_docs bitmask, adding new document names to self.docs.
+
+        :param dict remote: Version from self.remotes.
+        :param iter found_docs: Names of all documents in that version.
+        """
+        bits = frozenset(self.docs.setdefault(d, len(self.docs)) for d in found_docs)
+        mask = bytearray((len(self.docs) + 7) // 8)
+        for bit in bits:
+            mask[bit >> 3] |= 1 << (bit & 7)
+        remote['found_docs'] = int.from_bytes(bytes(mask), 'little')
+        self.doc_bits[remote['id']] = bits
+
     def vhasdoc(self, other_version):
         """Return True if the other version has the current document. Like Sphinx's hasdoc().
 
@@ -216,7 +348,9 @@ class Versions(object):
         """
         if self.context['current_version'] == other_version:
             return True
-        return self.context['pagename'] in self[other_version]['found_docs']
+        if self.hasdoc is not None:
+            return self.hasdoc[self[other_version]['name']]
+        return self.docs.get(self.context['pagename']) in self.doc_bits.get(self[other_version]['id'], ())
 
     def vpathto(self, other_version):
         """Return relative path to current document in another version. Like Sphinx's pathto().